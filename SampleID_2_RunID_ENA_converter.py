@@ -9,7 +9,7 @@ Secondary sample accession ID to ENA/SRA Run accession ID (via ENA repository)
 
 Copyright (C) 2016 Miguel Machado <mpmachado@medicina.ulisboa.pt>
 
-Last modified: September 25, 2016
+Last modified: October 18, 2026
 
 This program is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
@@ -25,133 +25,329 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import urllib2
+import httplib
+import urlparse
+import socket
+import threading
+import random
+import time
+import functools
+import itertools
+import json
 import xml.etree.ElementTree as ET
 import argparse
-import pickle
-import multiprocessing
+import multiprocessing.pool
 import sys
 import os
+import traceback
+
+import instrumentation
+import lookupcache
 
 
 version = '0.2'
 
+ena_view_url = 'http://www.ebi.ac.uk/ena/data/view/'
+
 
 def check_create_directory(directory):
 	if not os.path.isdir(directory):
 		os.makedirs(directory)
 
 
-def saveVariableToPickle(variableToStore, outdir, prefix):
-	pickleFile = os.path.join(outdir, str(prefix + '.pkl'))
-	with open(pickleFile, 'wb') as writer:
-		pickle.dump(variableToStore, writer)
-
+# HTTP fetcher shared by the worker threads. Each thread keeps its own keep-alive
+# connections (one per host), and all threads share a rate limit
+def build_fetcher(max_requests_per_second, retries, timeout):
+	return {'connections': threading.local(), 'lock': threading.Lock(), 'interval': 1.0 / max_requests_per_second, 'next_request': [0.0], 'retries': retries, 'timeout': timeout}
 
-def extractVariableFromPickle(pickleFile):
-	with open(pickleFile, 'rb') as reader:
-		variable = pickle.load(reader)
-	return variable
 
+def wait_rate_limit(fetcher):
+	with fetcher['lock']:
+		now = time.time()
+		request_time = max(now, fetcher['next_request'][0])
+		fetcher['next_request'][0] = request_time + fetcher['interval']
+	if request_time > now:
+		with instrumentation.timedStage('rate_limit_wait'):
+			time.sleep(request_time - now)
 
-def sampleID_2_RunID(sampleID):
-	sample_info = {'sample_primary_ID': None, 'sample_secondary_ID': None, 'ena_run': None, 'ena_study': None, 'center_name': None, 'attributes': {}}
 
-	url = "http://www.ebi.ac.uk/ena/data/view/" + sampleID + "&display=xml"
-
-	try:
-		content = urllib2.urlopen(url)
-		xml = content.read()
-		tree = ET.fromstring(xml)
-	except:
-		print 'It was not possible to connect ENA for ' + sampleID + ' sample ID'
-	else:
-		for child_1 in tree:
-			if child_1.tag == 'SAMPLE':
-					sample_info['center_name'] = child_1.attrib['center_name']
-
-			for child_2 in child_1:
-				if child_2.tag == 'IDENTIFIERS':
-					for child_3 in child_2:
-						if child_3.tag == 'PRIMARY_ID':
-							sample_info['sample_primary_ID'] = child_3.text
-						elif child_3.tag == 'EXTERNAL_ID':
-							sample_info['sample_secondary_ID'] = child_3.text
-				elif child_2.tag == 'SAMPLE_LINKS':
-					for child_3 in child_2:
-						for child_4 in child_3:
+def get_connection(fetcher, scheme, host):
+	connections = getattr(fetcher['connections'], 'by_host', None)
+	if connections is None:
+		connections = {}
+		fetcher['connections'].by_host = connections
+	if (scheme, host) not in connections:
+		if scheme == 'https':
+			connections[(scheme, host)] = httplib.HTTPSConnection(host, timeout=fetcher['timeout'])
+		else:
+			connections[(scheme, host)] = httplib.HTTPConnection(host, timeout=fetcher['timeout'])
+	return connections[(scheme, host)]
+
+
+def drop_connection(fetcher, scheme, host):
+	connection = fetcher['connections'].by_host.pop((scheme, host), None)
+	if connection is not None:
+		connection.close()
+
+
+# Get the content of an url, retrying connection errors and 429 and 5xx answers
+# read_content, if given, consumes the response stream and its result is returned instead
+def fetch_url(fetcher, url, read_content=None):
+	redirections = 0
+	attempt = 0
+	while True:
+		url_parts = urlparse.urlsplit(url)
+		path = url_parts.path + ('?' + url_parts.query if len(url_parts.query) > 0 else '')
+		wait_rate_limit(fetcher)
+		connection = get_connection(fetcher, url_parts.scheme, url_parts.netloc)
+		retry_after = None
+		try:
+			# Includes the parse_xml stage, when the response is parsed as it arrives
+			with instrumentation.timedStage('fetch') as stage:
+				connection.request('GET', path)
+				response = connection.getresponse()
+				if response.status == 200 and read_content is not None:
+					content = read_content(response)
+					# Whatever was left must be read for the connection to be reused
+					response.read()
+					if response.getheader('content-length', '').isdigit():
+						stage['bytes'] += int(response.getheader('content-length'))
+				else:
+					content = response.read()
+					stage['bytes'] += len(content)
+		except (httplib.HTTPException, socket.error) as e:
+			drop_connection(fetcher, url_parts.scheme, url_parts.netloc)
+			error = str(e)
+		except:
+			drop_connection(fetcher, url_parts.scheme, url_parts.netloc)
+			raise
+		else:
+			if response.getheader('connection', '').lower() == 'close':
+				drop_connection(fetcher, url_parts.scheme, url_parts.netloc)
+			if response.status == 200:
+				return content
+			elif response.status in (301, 302, 303, 307, 308) and response.getheader('location') is not None and redirections < 5:
+				url = urlparse.urljoin(url, response.getheader('location'))
+				redirections += 1
+				continue
+			elif response.status == 429 or response.status >= 500:
+				error = 'HTTP ' + str(response.status) + ' ' + response.reason
+				retry_after = response.getheader('retry-after')
+			else:
+				raise IOError('HTTP ' + str(response.status) + ' ' + response.reason + ' for ' + url)
+
+		if attempt >= fetcher['retries']:
+			raise IOError(error + ' for ' + url)
+		if retry_after is not None and retry_after.isdigit():
+			time.sleep(int(retry_after))
+		else:
+			time.sleep((2 ** attempt) * (0.5 + random.random()))
+		attempt += 1
+
+
+def new_sample_info():
+	return {'sample_primary_ID': None, 'sample_secondary_ID': None, 'ena_run': None, 'ena_study': None, 'center_name': None, 'attributes': {}, 'ena_runs': [], 'ena_studies': []}
+
+
+# Fill sample_info from a SAMPLE element and return the accessions the sample is known by
+def parse_sample_element(sample_element, sample_info):
+	sample_ids = set([sample_element.attrib.get('accession')])
+	sample_info['center_name'] = sample_element.attrib.get('center_name')
+
+	for child_2 in sample_element:
+		if child_2.tag == 'IDENTIFIERS':
+			for child_3 in child_2:
+				if child_3.tag == 'PRIMARY_ID':
+					sample_info['sample_primary_ID'] = child_3.text
+				elif child_3.tag == 'EXTERNAL_ID':
+					sample_info['sample_secondary_ID'] = child_3.text
+				if child_3.tag in ('PRIMARY_ID', 'SECONDARY_ID', 'EXTERNAL_ID'):
+					sample_ids.add(child_3.text)
+		elif child_2.tag == 'SAMPLE_LINKS':
+			for child_3 in child_2:
+				for child_4 in child_3:
+					tag_DB = False
+					text_ENA_RUN = False
+					text_ENA_STUDY = False
+					for child_5 in child_4:
+						if child_5.tag == 'DB':
+							tag_DB = True
+
+						if child_5.text == 'ENA-RUN':
+							text_ENA_RUN = True
+						elif child_5.text == 'ENA-STUDY':
+							text_ENA_STUDY = True
+
+						if tag_DB and text_ENA_RUN and child_5.tag == 'ID':
+							if sample_info['ena_run'] is None:
+								sample_info['ena_run'] = child_5.text
+							if child_5.text not in sample_info['ena_runs']:
+								sample_info['ena_runs'].append(child_5.text)
 							tag_DB = False
 							text_ENA_RUN = False
+						elif tag_DB and text_ENA_STUDY and child_5.tag == 'ID':
+							sample_info['ena_study'] = child_5.text
+							if child_5.text not in sample_info['ena_studies']:
+								sample_info['ena_studies'].append(child_5.text)
+							tag_DB = False
 							text_ENA_STUDY = False
-							for child_5 in child_4:
-								if child_5.tag == 'DB':
-									tag_DB = True
-
-								if child_5.text == 'ENA-RUN':
-									text_ENA_RUN = True
-								elif child_5.text == 'ENA-STUDY':
-									text_ENA_STUDY = True
-
-								if tag_DB and text_ENA_RUN and child_5.tag == 'ID':
-									if sample_info['ena_run'] is None:
-										sample_info['ena_run'] = child_5.text
-										tag_DB = False
-										text_ENA_RUN = False
-									else:
-										sys.exit('SampleID with more than one RunID!')
-								elif tag_DB and text_ENA_STUDY and child_5.tag == 'ID':
-									sample_info['ena_study'] = child_5.text
-									tag_DB = False
-									text_ENA_STUDY = False
-				elif child_2.tag == 'SAMPLE_ATTRIBUTES':
-					for child_3 in child_2:
+		elif child_2.tag == 'SAMPLE_ATTRIBUTES':
+			for child_3 in child_2:
+				tag_text = None
+				for child_4 in child_3:
+					if child_4.tag == 'TAG':
+						tag_text = child_4.text
+
+					if tag_text is not None and child_4.tag == 'VALUE':
+						sample_info['attributes'][tag_text.replace(' ', '_')] = child_4.text
 						tag_text = None
-						for child_4 in child_3:
-							if child_4.tag == 'TAG':
-								tag_text = child_4.text
-
-							if tag_text is not None and child_4.tag == 'VALUE':
-								sample_info['attributes'][tag_text.replace(' ', '_')] = child_4.text
-								tag_text = None
-		if sample_info['ena_run'] is None:
+
+	return set([sample_id.upper() for sample_id in sample_ids if sample_id is not None])
+
+
+# Parse an ENA XML answer as it arrives, one SAMPLE element at a time
+# Returns a list with the accessions and the sample_info of each SAMPLE
+def parse_samples_xml(source):
+	with instrumentation.timedStage('parse_xml') as stage:
+		samples_found = parse_samples_elements(source)
+		stage['records'] += len(samples_found)
+	return samples_found
+
+
+def parse_samples_elements(source):
+	samples_found = []
+	root = None
+	depth = 0
+	for event, element in ET.iterparse(source, events=('start', 'end')):
+		if event == 'start':
+			if root is None:
+				root = element
+			depth += 1
+		else:
+			depth -= 1
+			if depth == 1:
+				if element.tag == 'SAMPLE':
+					sample_info = new_sample_info()
+					sample_ids = parse_sample_element(element, sample_info)
+					samples_found.append([sample_ids, sample_info])
+				root.clear()
+	return samples_found
+
+
+# Get the information of a batch of samples with a single request. The samples not found
+# in the answer (all of them, if the request fails) are asked one by one
+def sampleIDs_2_RunIDs(sampleIDs, fetcher):
+	samples_info = {}
+	retried = []
+
+	url = ena_view_url + ','.join(sampleIDs) + "&display=xml"
+
+	try:
+		samples_found = fetch_url(fetcher, url, parse_samples_xml)
+	except Exception:
+		if len(sampleIDs) > 1:
+			print 'It was not possible to get the batch of sample IDs starting with ' + sampleIDs[0] + ' from ENA, trying them one by one'
+			for sampleID in sampleIDs:
+				samples_info.update(sampleIDs_2_RunIDs([sampleID], fetcher))
+			return samples_info
+		print 'It was not possible to connect ENA for ' + sampleIDs[0] + ' sample ID'
+	else:
+		for sample_ids, sample_info in samples_found:
+			for sampleID in sampleIDs:
+				if sampleID.upper() in sample_ids and sampleID not in samples_info:
+					samples_info[sampleID] = sample_info
+		# Samples asked by other identifiers (an alias, for example) are only matched alone
+		if len(sampleIDs) == 1 and len(samples_found) == 1 and len(samples_info) == 0:
+			samples_info[sampleIDs[0]] = samples_found[0][1]
+		elif len(sampleIDs) > 1:
+			retried = [sampleID for sampleID in sampleIDs if sampleID not in samples_info]
+			for sampleID in retried:
+				samples_info.update(sampleIDs_2_RunIDs([sampleID], fetcher))
+
+	for sampleID in sampleIDs:
+		if sampleID in retried:
+			continue
+		if sampleID not in samples_info:
+			samples_info[sampleID] = new_sample_info()
+		if samples_info[sampleID]['ena_run'] is None:
 			print 'It was not possible to retrieve ENA for ' + sampleID + ' sample ID'
 		else:
 			print sampleID + ' - DONE'
-	return sample_info
+	return samples_info
 
 
-def get_sample_info(sampleID, outdir):
-	sample_info = sampleID_2_RunID(sampleID)
-	saveVariableToPickle(sample_info, outdir, str(sampleID + '_sample_info'))
+# Information of a batch of samples, in a pool worker
+def get_samples_info(sampleIDs, fetcher):
+	try:
+		with instrumentation.profiled():
+			samples_info = sampleIDs_2_RunIDs(sampleIDs, fetcher)
+		return [[sampleID, samples_info[sampleID], None] for sampleID in sampleIDs]
+	except (Exception, SystemExit):
+		error = traceback.format_exc()
+		return [[sampleID, None, error] for sampleID in sampleIDs]
 
 
-def gather_all_samples_info(outdir):
+# Gather the samples information as the pool workers return it. With multiple_runs set
+# to 'problem', the samples with more than one run are reported as problems
+def gather_all_samples_info(samples_results, outdir, multiple_runs):
 	info = {}
 
 	attributes = set([])
 
 	with open(os.path.join(outdir, 'sampleID_with_problems.txt'), 'wt') as writer:
-		files = [f for f in os.listdir(outdir) if not f.startswith('.') and os.path.isfile(os.path.join(outdir, f))]
-		for file_found in files:
-			if file_found.endswith('_sample_info.pkl'):
-				file_path = os.path.join(outdir, file_found)
-
-				sample = file_found.split('_', 1)[0]
-				sample_info = extractVariableFromPickle(file_path)
-
-				if sample_info['ena_run'] is not None:
-					info[sample] = sample_info
-					attributes = attributes.union(set(sample_info['attributes'].keys()))
-				else:
-					writer.write(sample + '\n')
-
-				os.remove(file_path)
+		for sample, sample_info, error in samples_results:
+			if error is not None:
+				print 'It was not possible to get ' + sample + ' sample information' + '\n' + error
+			elif multiple_runs == 'problem' and len(sample_info['ena_runs']) > 1:
+				print sample + ' sample ID has more than one RunID: ' + ', '.join(sample_info['ena_runs'])
+				sample_info = None
+
+			if sample_info is not None and sample_info['ena_run'] is not None:
+				info[sample] = sample_info
+				attributes = attributes.union(set(sample_info['attributes'].keys()))
+			else:
+				writer.write(sample + '\n')
+				writer.flush()
 
 	attributes = sorted(list(attributes))
 
 	return info, attributes
 
 
+# Store in the cache the samples successfully retrieved, a batch at a time
+def cache_samples_info(batches_results, cache):
+	for batch_results in batches_results:
+		lookupcache.cache_put(cache, 'ena_sample', [[sample, sample_info] for sample, sample_info, error in batch_results if sample_info is not None and sample_info['ena_run'] is not None])
+		yield batch_results
+
+
+# Checkpoint journal: every sample result is appended (one JSON object per line) as
+# soon as it arrives, so that an interrupted run can be resumed from it
+def read_checkpoint_journal(journal_file):
+	samples_info = {}
+	if os.path.isfile(journal_file):
+		with open(journal_file, 'rtU') as reader:
+			for line in reader:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# The last line may have been left incomplete by the interruption
+					continue
+				samples_info[entry['sample']] = entry['sample_info']
+	return samples_info
+
+
+def journal_samples_info(samples_results, journal_writer):
+	for sample, sample_info, error in samples_results:
+		with instrumentation.timedStage('journal') as stage:
+			entry = json.dumps({'sample': sample, 'sample_info': sample_info}) + '\n'
+			journal_writer.write(entry)
+			journal_writer.flush()
+			stage['bytes'] += len(entry)
+			stage['records'] += 1
+		yield sample, sample_info, error
+
+
 def check_attributes_present(list_all_attributes, dict_sample_attributes):
 	dict_all_attributes = {}
 	for attribute in list_all_attributes:
@@ -177,30 +373,91 @@ def run_SampleID_2_RunID_ENA_converter(args):
 			if len(line) > 0:
 				inputSampleIDlist.append(line.splitlines()[0])
 
-	pool = multiprocessing.Pool(processes=threads)
-	for sample in inputSampleIDlist:
-		pool.apply_async(get_sample_info, args=(sample, outdir,))
+	# Samples already resolved in the interrupted run are not fetched again
+	journal_file = os.path.join(outdir, 'sampleID_to_runID.checkpoint.jsonl')
+	journal_results = []
+	if args.resume:
+		journal_samples = read_checkpoint_journal(journal_file)
+		samples_to_fetch = []
+		for sampleID in inputSampleIDlist:
+			if journal_samples.get(sampleID) is not None and journal_samples[sampleID]['ena_run'] is not None:
+				journal_results.append([sampleID, journal_samples[sampleID], None])
+			else:
+				samples_to_fetch.append(sampleID)
+		print str(len(journal_results)) + ' sample IDs already resolved, ' + str(len(samples_to_fetch)) + ' sample IDs left to resolve' + '\n'
+		inputSampleIDlist = samples_to_fetch
+	journal_writer = open(journal_file, 'at' if args.resume else 'wt')
+	if args.resume and os.path.getsize(journal_file) > 0:
+		with open(journal_file, 'rb') as reader:
+			reader.seek(-1, os.SEEK_END)
+			if reader.read(1) != '\n':
+				journal_writer.write('\n')
+
+	cache = None
+	cached_results = []
+	if args.cacheFile is not None:
+		cache = lookupcache.open_cache(args.cacheFile, args.cacheTTL, args.cacheMaxEntries, args.offline)
+		samples_to_fetch = []
+		for sampleID in inputSampleIDlist:
+			sample_info = lookupcache.cache_get(cache, 'ena_sample', sampleID)
+			if sample_info is not None:
+				print sampleID + ' - DONE (cached)'
+				cached_results.append([sampleID, sample_info, None])
+			elif args.offline:
+				print sampleID + ' sample ID not found in cache'
+				cached_results.append([sampleID, new_sample_info(), None])
+			else:
+				samples_to_fetch.append(sampleID)
+		lookupcache.commit_cache(cache)
+		inputSampleIDlist = samples_to_fetch
+
+	batches = [inputSampleIDlist[i:i + args.batchSize] for i in range(0, len(inputSampleIDlist), args.batchSize)]
+
+	# Fetching is network bound, so the batches are handled by threads sharing the fetcher
+	fetcher = build_fetcher(args.maxRequestsPerSecond, args.retries, args.timeout)
+	pool = multiprocessing.pool.ThreadPool(processes=threads)
+	batches_results = pool.imap_unordered(functools.partial(get_samples_info, fetcher=fetcher), batches)
+	if cache is not None:
+		batches_results = cache_samples_info(batches_results, cache)
+	samples_results = itertools.chain(cached_results, itertools.chain.from_iterable(batches_results))
+	samples_results = itertools.chain(journal_results, journal_samples_info(samples_results, journal_writer))
+	samples_info, samples_attributes = gather_all_samples_info(samples_results, outdir, args.multipleRuns)
 	pool.close()
 	pool.join()
-
-	samples_info, samples_attributes = gather_all_samples_info(outdir)
+	journal_writer.close()
+	if cache is not None:
+		lookupcache.evict_cache(cache)
+		lookupcache.close_cache(cache)
 
 	counter = 0
-	with open(os.path.join(outdir, 'sampleID_to_runID.tab'), 'wt') as writer:
+	with instrumentation.timedStage('write_table') as stage, open(os.path.join(outdir, 'sampleID_to_runID.tab'), 'wt') as writer:
 		partial_header = ['sample_primary_ID', 'sample_secondary_ID', 'ena_run', 'ena_study', 'center_name']
 		writer.write('#' + '\t'.join(partial_header) + '\t' + '\t'.join(samples_attributes) + '\n')
 		for sample in samples_info:
-			sample_values = []
-			for field in partial_header:
-				sample_values.append(str(samples_info[sample][field]))
-
-			dict_sample_all_attributes = check_attributes_present(samples_attributes, samples_info[sample]['attributes'])
-			for attribute in samples_attributes:
-				sample_values.append(str(dict_sample_all_attributes[attribute]))
-
-			writer.write('\t'.join(sample_values) + '\n')
+			# One row per run, or a single row with the comma separated runs (and studies)
+			if args.multipleRuns == 'rows':
+				sample_runs = samples_info[sample]['ena_runs']
+			else:
+				sample_runs = [','.join(samples_info[sample]['ena_runs'])]
+
+			for run in sample_runs:
+				sample_values = []
+				for field in partial_header:
+					if field == 'ena_run':
+						sample_values.append(run)
+					elif field == 'ena_study' and len(samples_info[sample]['ena_studies']) > 1:
+						sample_values.append(','.join(samples_info[sample]['ena_studies']))
+					else:
+						sample_values.append(str(samples_info[sample][field]))
+
+				dict_sample_all_attributes = check_attributes_present(samples_attributes, samples_info[sample]['attributes'])
+				for attribute in samples_attributes:
+					sample_values.append(str(dict_sample_all_attributes[attribute]))
+
+				writer.write('\t'.join(sample_values) + '\n')
 
 			counter += 1
+		stage['records'] += counter
 
 	if counter == 0:
 		sys.exit('No SampleIDs  were RunID converted!')
@@ -220,13 +477,32 @@ def main():
 
 	parser_optional = parser.add_argument_group('Facultative options')
 	parser_optional.add_argument('-o', '--outdir', type=str, metavar='/path/to/output/directory/', help='Path for output directory', required=False, default='./')
-	parser_optional.add_argument('-j', '--threads', metavar=('N'), type=int, help='Number of threads to be used', required=False, default=1)
+	parser_optional.add_argument('-j', '--threads', metavar=('N'), type=int, help='Number of threads to be used (each thread makes one ENA request at a time over its own keep-alive connection)', required=False, default=1)
+	parser_optional.add_argument('--multipleRuns', choices=['problem', 'rows', 'list'], help='What to do with samples linked to more than one run: report them in sampleID_with_problems.txt ("problem"), write one row per run ("rows") or write a single row with the runs separated by commas ("list")', required=False, default='problem')
+	parser_optional.add_argument('--resume', action='store_true', help='Resume an interrupted run in the same output directory: sample IDs already resolved in its checkpoint journal (sampleID_to_runID.checkpoint.jsonl) are not fetched again, only the ones not yet tried or that had problems')
+	parser_optional.add_argument('--profile', action='store_true', help='Profile the run with cProfile (all threads together in SampleID_2_RunID_ENA_converter.profile.pstats and the top functions in SampleID_2_RunID_ENA_converter.profile.txt, in outdir)')
+	parser_optional.add_argument('-b', '--batchSize', metavar=('N'), type=int, help='Number of sample IDs requested to ENA in each request', required=False, default=50)
+	parser_optional.add_argument('--maxRequestsPerSecond', metavar=('N'), type=float, help='Maximum number of requests per second made to ENA by all threads together', required=False, default=10)
+	parser_optional.add_argument('--retries', metavar=('N'), type=int, help='Number of times a failed ENA request is retried (with exponential backoff)', required=False, default=3)
+	parser_optional.add_argument('--timeout', metavar=('N'), type=float, help='Timeout in seconds for ENA connections', required=False, default=60)
+
+	parser_cache = parser.add_argument_group('Cache options')
+	parser_cache.add_argument('--cacheFile', type=str, metavar='/path/to/accessions_cache.sqlite', help='SQLite file used to cache the samples information between runs (created if it does not exist)', required=False)
+	parser_cache.add_argument('--cacheTTL', metavar=('DAYS'), type=float, help='Number of days after which cached samples information is retrieved again (0 keeps it forever)', required=False, default=30)
+	parser_cache.add_argument('--cacheMaxEntries', metavar=('N'), type=int, help='Maximum number of entries kept in the cache, the least recently used are removed first (0 for no limit)', required=False, default=1000000)
+	parser_cache.add_argument('--offline', action='store_true', help='Do not connect to ENA, use only the cached samples information (requires --cacheFile)')
 
 	parser.set_defaults(func=run_SampleID_2_RunID_ENA_converter)
 
 	args = parser.parse_args()
 
-	args.func(args)
+	if args.offline and args.cacheFile is None:
+		parser.error('--offline requires --cacheFile')
+
+	# Timings of each stage go to SampleID_2_RunID_ENA_converter.instrumentation.json in outdir
+	outdir = os.path.abspath(args.outdir)
+	check_create_directory(outdir)
+	instrumentation.runInstrumented(args.func, (args,), outdir, 'SampleID_2_RunID_ENA_converter.py', version, args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+benchmarkThroughput.py - Throughput benchmarks of checkFastqFiles.py,
+renamePE_samtoolsFASTQ.py and the renameSequences of getCompleteGenomes.py
+over deterministic synthetic data
+<https://github.com/miguelpmachado/pythonScripts>
+
+Copyright (C) 2026 Miguel Machado <mpmachado@medicina.ulisboa.pt>
+
+Last modified: October 18, 2026
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import sys
+import time
+import random
+import subprocess
+import gzip
+import bz2
+import json
+import shutil
+import platform
+import multiprocessing
+
+version = '0.1'
+
+scripts_directory = os.path.dirname(os.path.abspath(__file__))
+
+bases = 'ACGT'
+qualities = ''.join(chr(character) for character in range(35, 74))
+
+
+def openOutput(file_path, compression):
+	if compression == 'gzip':
+		return gzip.open(file_path, 'wb', 6)
+	elif compression == 'bzip2':
+		return bz2.BZ2File(file_path, 'wb')
+	return open(file_path, 'wb')
+
+
+def compressionExtension(compression):
+	return {'none': '', 'gzip': '.gz', 'bzip2': '.bz2'}[compression]
+
+
+# Random sequences are built from a pool of random chunks, so that the generation
+# (deterministic for a seed) does not take longer than the benchmarks themselves
+def randomChunks(generator, alphabet, number_chunks, chunk_length):
+	return [''.join(generator.choice(alphabet) for i in range(0, chunk_length)) for j in range(0, number_chunks)]
+
+
+def randomString(generator, chunks, length):
+	chunk_length = len(chunks[0])
+	string = ''.join(generator.choice(chunks) for i in range(0, -(-length // chunk_length)))
+	return string[:length]
+
+
+# Write number_reads reads (both mates when fastq_2 is given, with the same read names
+# as samtools fastq writes them). The malformed_reads records (spread through the file
+# and only in mate 1) have a quality line shorter than their sequence
+def generateFastq(fastq_1, fastq_2, number_reads, read_length, compression, malformed_reads, seed):
+	generator = random.Random(seed)
+	sequence_chunks = randomChunks(generator, bases, 256, 64)
+	quality_chunks = randomChunks(generator, qualities, 256, 64)
+	malformed = set(generator.sample(xrange(number_reads), malformed_reads)) if malformed_reads > 0 else set()
+	writers = [openOutput(fastq, compression) for fastq in (fastq_1, fastq_2) if fastq is not None]
+	try:
+		buffers = [[] for writer in writers]
+		for read in xrange(number_reads):
+			header = '@SYNTHETIC.' + str(seed) + '.' + str(read)
+			for mate, writer in enumerate(writers):
+				sequence = randomString(generator, sequence_chunks, read_length)
+				quality = randomString(generator, quality_chunks, read_length)
+				if mate == 0 and read in malformed:
+					quality = quality[:-1]
+				buffers[mate].append(header + '\n' + sequence + '\n+\n' + quality + '\n')
+			if len(buffers[0]) >= 10000:
+				for writer, mate_buffer in zip(writers, buffers):
+					writer.write(''.join(mate_buffer))
+				buffers = [[] for writer in writers]
+		for writer, mate_buffer in zip(writers, buffers):
+			writer.write(''.join(mate_buffer))
+	finally:
+		for writer in writers:
+			writer.close()
+
+
+# Write a gzip compressed genome with NCBI like headers and its accessions (to be put in
+# the accession to GI cache, so that renameSequences runs without network)
+def generateGenome(fasta, number_contigs, contig_length, seed):
+	generator = random.Random(seed)
+	sequence_chunks = randomChunks(generator, bases, 256, 80)
+	accessions = []
+	with gzip.open(fasta, 'wb', 6) as writer:
+		for contig in range(0, number_contigs):
+			accession = 'NZ_SYN' + str(seed).zfill(4) + str(contig).zfill(6) + '.1'
+			accessions.append(accession)
+			sequence = randomString(generator, sequence_chunks, contig_length)
+			writer.write('>' + accession + ' Synthetic bacterium strain ' + str(seed) + ' contig ' + str(contig) + ', whole genome shotgun sequence\n')
+			writer.write('\n'.join(sequence[i:i + 80] for i in range(0, len(sequence), 80)) + '\n')
+	return accessions
+
+
+def fillAccessionsCache(cache_file, accessions):
+	sys.path.insert(0, scripts_directory)
+	import lookupcache
+	cache = lookupcache.open_cache(cache_file, 0, 0, True)
+	lookupcache.cache_put(cache, 'nuccore_gi', [[accession, str(1000000 + i)] for i, accession in enumerate(accessions)])
+	lookupcache.close_cache(cache)
+
+
+# Run a command and get its wall time, CPU time (user and system, including the
+# processes it started and waited for) and peak resident memory
+def runMeasured(command, workdir):
+	with open(os.path.join(workdir, 'benchmark.log'), 'at') as log:
+		log.write('\n' + ' '.join(command) + '\n')
+		log.flush()
+		start_time = time.time()
+		proc = subprocess.Popen(command, stdout=log, stderr=log, cwd=workdir)
+		pid, status, rusage = os.wait4(proc.pid, 0)
+		wall_time = time.time() - start_time
+	proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+	return {'return_code': proc.returncode, 'seconds': round(wall_time, 4), 'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 4), 'peak_rss_kb': rusage.ru_maxrss}
+
+
+# Best (fastest) of the repeats of a command, with the throughput for the input given
+def benchmark(tool, case, threads, command, workdir, input_bytes, records, repeats, clean=None):
+	runs = []
+	for repeat in range(0, repeats):
+		if clean is not None:
+			shutil.rmtree(clean, True)
+			os.makedirs(clean)
+		runs.append(runMeasured(command, workdir))
+	best = min(runs, key=lambda run: run['seconds'])
+	result = {'tool': tool, 'case': case, 'threads': threads, 'command': ' '.join(command), 'input_bytes': input_bytes, 'records': records, 'repeats': repeats}
+	result.update(best)
+	result['mb_per_second'] = round(input_bytes / 1024.0 / 1024.0 / best['seconds'], 2) if best['seconds'] > 0 else None
+	result['records_per_second'] = round(records / best['seconds'], 1) if best['seconds'] > 0 else None
+	result['all_seconds'] = [run['seconds'] for run in runs]
+	print tool + ' ' + case + ' -j ' + str(threads) + ': ' + str(result['mb_per_second']) + ' MB/s, ' + str(result['records_per_second']) + ' records/s, ' + str(best['peak_rss_kb']) + ' KB peak RSS' + ('' if best['return_code'] == 0 else ' (exit code ' + str(best['return_code']) + ')')
+	return result
+
+
+def filesSize(files):
+	return sum(os.path.getsize(file_path) for file_path in files)
+
+
+def runBenchmarks(args):
+	workdir = os.path.abspath(args.outdir)
+	data_directory = os.path.join(workdir, 'data')
+	if not os.path.isdir(data_directory):
+		os.makedirs(data_directory)
+	python = sys.executable
+	results = []
+
+	print 'Generating the synthetic data in ' + data_directory + '\n'
+	fastq_sets = {}
+	for compression in args.compression:
+		extension = '.fq' + compressionExtension(compression)
+		pairs = []
+		for sample in range(0, args.files):
+			fastq_1 = os.path.join(data_directory, 'sample' + str(sample) + '_' + compression + '_1' + extension)
+			fastq_2 = os.path.join(data_directory, 'sample' + str(sample) + '_' + compression + '_2' + extension)
+			generateFastq(fastq_1, fastq_2, args.reads, args.readLength, compression, 0, args.seed + sample)
+			pairs.append([fastq_1, fastq_2])
+		fastq_sets[compression] = pairs
+	malformed_fastq = None
+	if args.malformed > 0:
+		malformed_fastq = os.path.join(data_directory, 'malformed_1.fq')
+		generateFastq(malformed_fastq, None, args.reads, args.readLength, 'none', args.malformed, args.seed + args.files)
+	genome = os.path.join(data_directory, 'genome.fna.gz')
+	accessions = generateGenome(genome, args.contigs, args.contigLength, args.seed)
+	cache_file = os.path.join(data_directory, 'accessions_cache.sqlite')
+	if os.path.isfile(cache_file):
+		os.remove(cache_file)
+	fillAccessionsCache(cache_file, accessions)
+
+	for compression in args.compression:
+		pairs = fastq_sets[compression]
+		mates_1 = [pair[0] for pair in pairs]
+		check_outdir = os.path.join(workdir, 'checkFastqFiles_' + compression)
+		for threads in args.threads:
+			command = [python, os.path.join(scripts_directory, 'checkFastqFiles.py'), '-i'] + mates_1 + ['-o', check_outdir, '-j', str(threads)]
+			results.append(benchmark('checkFastqFiles', compression + ' ' + str(len(mates_1)) + ' files', threads, command, workdir, filesSize(mates_1), args.reads * len(mates_1), args.repeats, check_outdir))
+
+		rename_outdir = os.path.join(workdir, 'renamePE_' + compression)
+		command = [python, os.path.join(scripts_directory, 'renamePE_samtoolsFASTQ.py'), '-1', pairs[0][0], '-2', pairs[0][1], '-o', rename_outdir]
+		results.append(benchmark('renamePE_samtoolsFASTQ', compression + ' 1 pair', 1, command, workdir, filesSize(pairs[0]), args.reads, args.repeats, rename_outdir))
+		sample_sheet = os.path.join(data_directory, 'sample_sheet_' + compression + '.tab')
+		with open(sample_sheet, 'wt') as writer:
+			for sample, pair in enumerate(pairs):
+				writer.write('\t'.join(['sample' + str(sample)] + pair) + '\n')
+		for threads in args.threads:
+			command = [python, os.path.join(scripts_directory, 'renamePE_samtoolsFASTQ.py'), '--sampleSheet', sample_sheet, '-o', rename_outdir, '-j', str(threads)]
+			results.append(benchmark('renamePE_samtoolsFASTQ', compression + ' ' + str(len(pairs)) + ' pairs', threads, command, workdir, filesSize([fastq for pair in pairs for fastq in pair]), args.reads * len(pairs), args.repeats, rename_outdir))
+
+	if malformed_fastq is not None:
+		check_outdir = os.path.join(workdir, 'checkFastqFiles_malformed')
+		command = [python, os.path.join(scripts_directory, 'checkFastqFiles.py'), '-i', malformed_fastq, '-o', check_outdir]
+		results.append(benchmark('checkFastqFiles', 'malformed 1 file', 1, command, workdir, filesSize([malformed_fastq]), args.reads, args.repeats, check_outdir))
+
+	renamed_genome = os.path.join(workdir, 'genome.fna.renamed.fasta')
+	command = [python, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); import getCompleteGenomes; getCompleteGenomes.renameSequences(sys.argv[2], sys.argv[3], [sys.argv[4], 0, 0, True])', scripts_directory, genome, renamed_genome, cache_file]
+	results.append(benchmark('renameSequences', str(args.contigs) + ' contigs', 1, command, workdir, filesSize([genome]), args.contigs, args.repeats))
+
+	report = {'version': version, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': multiprocessing.cpu_count(), 'settings': {'reads': args.reads, 'read_length': args.readLength, 'files': args.files, 'compression': args.compression, 'malformed': args.malformed, 'contigs': args.contigs, 'contig_length': args.contigLength, 'seed': args.seed, 'threads': args.threads, 'repeats': args.repeats}, 'results': results}
+	report_file = os.path.abspath(args.report) if args.report is not None else os.path.join(workdir, 'benchmark.' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+	with open(report_file, 'wt') as writer:
+		json.dump(report, writer, indent=1, sort_keys=True)
+	print '\n' + 'Results written to ' + report_file
+
+	if not args.keepData:
+		shutil.rmtree(data_directory, True)
+
+	failed = [result for result in results if result['return_code'] != 0 and not result['case'].startswith('malformed')]
+	if len(failed) > 0:
+		sys.exit(str(len(failed)) + ' benchmarks did not run successfully (see ' + os.path.join(workdir, 'benchmark.log') + ')')
+
+
+def main():
+	parser = argparse.ArgumentParser(prog='python benchmarkThroughput.py', description='Throughput benchmarks of checkFastqFiles.py, renamePE_samtoolsFASTQ.py and the renameSequences of getCompleteGenomes.py over deterministic synthetic data', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument('--version', help='Version information', action='version', version=str('%(prog)s v' + version))
+
+	parser_optional = parser.add_argument_group('Facultative options')
+	parser_optional.add_argument('-o', '--outdir', type=str, metavar='/output/directory/', help='Path for the synthetic data and the outputs of the benchmarks', required=False, default='benchmark')
+	parser_optional.add_argument('--report', type=str, metavar='/path/to/benchmark.json', help='JSON file for the results (by default, benchmark.<date>.json in outdir)', required=False)
+	parser_optional.add_argument('--reads', type=int, metavar='N', help='Number of reads (pairs) of each fastq file', required=False, default=200000)
+	parser_optional.add_argument('--readLength', type=int, metavar='N', help='Length of the reads', required=False, default=150)
+	parser_optional.add_argument('--files', type=int, metavar='N', help='Number of paired-end samples generated for each compression', required=False, default=4)
+	parser_optional.add_argument('--compression', nargs='+', choices=['none', 'gzip', 'bzip2'], help='Compression of the fastq files (one set of samples for each)', required=False, default=['none', 'gzip'])
+	parser_optional.add_argument('--malformed', type=int, metavar='N', help='Number of malformed records of an extra fastq file that is also checked (0 for no such file)', required=False, default=10)
+	parser_optional.add_argument('--contigs', type=int, metavar='N', help='Number of contigs of the synthetic genome', required=False, default=2000)
+	parser_optional.add_argument('--contigLength', type=int, metavar='N', help='Length of the contigs of the synthetic genome', required=False, default=5000)
+	parser_optional.add_argument('-j', '--threads', nargs='+', type=int, metavar='N', help='Numbers of threads for which the scaling is measured', required=False, default=[1, 2, 4])
+	parser_optional.add_argument('--repeats', type=int, metavar='N', help='Times each benchmark is run (the fastest run is kept)', required=False, default=1)
+	parser_optional.add_argument('--seed', type=int, metavar='N', help='Seed of the synthetic data', required=False, default=1)
+	parser_optional.add_argument('--keepData', action='store_true', help='Keep the synthetic data after the benchmarks')
+
+	args = parser.parse_args()
+
+	print '\n' + 'STARTING benchmarkThroughput.py' + '\n'
+	runBenchmarks(args)
+	print '\n' + 'END benchmarkThroughput.py'
+
+
+if __name__ == "__main__":
+	main()
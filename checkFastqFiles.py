@@ -1,54 +1,779 @@
 import multiprocessing
 import argparse
 import os
+import io
+import itertools
+import operator
+import threading
+import Queue
+import traceback
+import sys
+import json
+import time
+import sqlite3
 import pickle
+import hashlib
+
+import fastqio
+import instrumentation
+
+# numpy (optional) speeds up the counting of the statistics mode
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 version = '0.2'
 
+block_size = 8 * 1024 * 1024
+
+# Uncompressed files smaller than this are never split into byte ranges
+min_range_size = 32 * 1024 * 1024
+# Largest window searched for the first record of a byte range
+max_sync_window = 64 * 1024 * 1024
+
+
+# Offset of the quality characters (Sanger / Illumina 1.8+ encoding)
+quality_offset = 33
+# Records kept by the line engine before their statistics are counted
+statistics_batch_size = 4096
+
+# Characters accepted by the error localisation in the sequences (IUPAC codes) and in
+# the qualities (printable characters)
+valid_sequence_characters = 'ACGTUNRYKMSWBDHV.acgtunrykmswbdhv'
+valid_quality_characters = ''.join(chr(character) for character in range(33, 127))
+
+# Validation ledger (in outdir) with the result of each file checked, so that only new
+# or modified files are checked again
+ledger_file_name = 'checkFastqFiles.ledger.sqlite'
+# Bytes read at the start and at the end of a file for its fingerprint
+fingerprint_size = 64 * 1024
+
+# Blocks of record names held by the queue of each mate, in paired mode
+pair_queue_size = 4
+
+
+# Decompressed streams are read in binary mode: their lines are split here as the
+# uncompressed files are by universal newlines (and as splitBlockLines does)
+def universalNewlineLines(reader):
+	for line in reader:
+		if '\r' in line:
+			for part in line.splitlines(True):
+				yield part
+		else:
+			yield line
+
+
+# Line-by-line state machine over the fastq lines. The block engine also uses it to
+# finish a file from the first block it cannot validate on its own, so both engines
+# always agree on the counts (and on the statistics, if given)
+def checkFastqLines(lines, number_reads_components, statistics=None):
+	plus_line = True
+	quality_line = True
+	length_sequence = 0
+	sequence = ''
+	sequences = []
+	qualities = []
+	for line in lines:
+		if len(line) > 0:
+			if line.startswith('@') and plus_line and quality_line:
+				number_reads_components[0] += 1
+				plus_line = False
+				quality_line = False
+				length_sequence = 0
+				sequence = ''
+			elif line.startswith('+') and not plus_line:
+				number_reads_components[2] += 1
+				plus_line = True
+			elif plus_line and not quality_line:
+				line = line.splitlines()[0]
+				if len(line) != length_sequence:
+					print 'Sequence length and quality length are not equal!'
+					break
+				else:
+					quality_line = True
+					number_reads_components[3] += 1
+					if statistics is not None:
+						sequences.append(sequence)
+						qualities.append(line)
+						if len(sequences) >= statistics_batch_size:
+							addStatistics(statistics, sequences, qualities)
+							sequences = []
+							qualities = []
+			else:
+				number_reads_components[1] += 1
+				line = line.splitlines()[0]
+				length_sequence = len(line)
+				sequence = line
+	if statistics is not None:
+		addStatistics(statistics, sequences, qualities)
+
+
+# Statistics of the records checked: counts of each character of the sequences and of
+# the qualities, and distribution of the read lengths
+def newStatistics():
+	return {'sequence_characters': [0] * 256, 'quality_characters': [0] * 256, 'lengths': {}}
+
+
+def countCharacters(data, counts):
+	if numpy is not None:
+		for character, count in enumerate(numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=256).tolist()):
+			counts[character] += count
+	else:
+		# The characters present are taken from the start of the data (and from what is
+		# left without them, if anything), sparing a pass over all the data
+		while len(data) > 0:
+			characters = set(data[:65536])
+			for character in characters:
+				counts[ord(character)] += data.count(character)
+			data = data.translate(None, ''.join(characters))
+
+
+def countLengths(lengths, distribution):
+	if len(lengths) == 0:
+		return
+	if numpy is not None:
+		counts = numpy.bincount(numpy.array(lengths, dtype=numpy.int64))
+		for length in numpy.nonzero(counts)[0].tolist():
+			distribution[length] = distribution.get(length, 0) + int(counts[length])
+		return
+	different_lengths = set(lengths)
+	if len(different_lengths) <= 64:
+		for length in different_lengths:
+			distribution[length] = distribution.get(length, 0) + lengths.count(length)
+	else:
+		for length in lengths:
+			distribution[length] = distribution.get(length, 0) + 1
+
+
+def addStatistics(statistics, sequences, qualities):
+	with instrumentation.timedStage('statistics') as stage:
+		countCharacters(''.join(sequences), statistics['sequence_characters'])
+		countCharacters(''.join(qualities), statistics['quality_characters'])
+		countLengths(map(len, sequences), statistics['lengths'])
+		stage['records'] += len(sequences)
+
+
+def mergeStatistics(statistics, other_statistics):
+	for counts in ('sequence_characters', 'quality_characters'):
+		for character in range(0, 256):
+			statistics[counts][character] += other_statistics[counts][character]
+	for length, count in other_statistics['lengths'].items():
+		statistics['lengths'][length] = statistics['lengths'].get(length, 0) + count
+
+
+# Base counts (lower case bases counted as upper case), GC and N content, read lengths
+# and quality histogram of the statistics
+def summariseStatistics(statistics):
+	bases = {}
+	for character in range(0, 256):
+		if statistics['sequence_characters'][character] > 0:
+			base = chr(character).upper()
+			bases[base] = bases.get(base, 0) + statistics['sequence_characters'][character]
+	number_bases = sum(bases.values())
+	acgt_bases = sum(bases.get(base, 0) for base in 'ACGT')
+	number_reads = sum(statistics['lengths'].values())
+	quality_histogram = {}
+	quality_sum = 0
+	for character in range(0, 256):
+		if statistics['quality_characters'][character] > 0:
+			quality_histogram[character - quality_offset] = statistics['quality_characters'][character]
+			quality_sum += (character - quality_offset) * statistics['quality_characters'][character]
+	number_qualities = sum(quality_histogram.values())
+	return {'number_reads': number_reads,
+			'number_bases': number_bases,
+			'base_counts': bases,
+			'gc_percent': round(100.0 * (bases.get('G', 0) + bases.get('C', 0)) / acgt_bases, 2) if acgt_bases > 0 else None,
+			'n_percent': round(100.0 * bases.get('N', 0) / number_bases, 4) if number_bases > 0 else None,
+			'min_length': min(statistics['lengths']) if number_reads > 0 else None,
+			'max_length': max(statistics['lengths']) if number_reads > 0 else None,
+			'mean_length': round(float(number_bases) / number_reads, 2) if number_reads > 0 else None,
+			'length_distribution': statistics['lengths'],
+			'quality_offset': quality_offset,
+			'quality_histogram': quality_histogram,
+			'mean_quality': round(float(quality_sum) / number_qualities, 2) if number_qualities > 0 else None}
+
+
+# Read the file in big binary blocks (reusing the same buffer) and yield text blocks
+# that always end in a complete line
+def readFastqBlocks(reader, block_size):
+	buffer = bytearray(block_size)
+	remainder = ''
+	while True:
+		# Waiting for the decompressor, for compressed files
+		with instrumentation.timedStage('read') as stage:
+			bytes_read = reader.readinto(buffer)
+			stage['bytes'] += bytes_read or 0
+		if not bytes_read:
+			break
+		block = remainder + str(buffer[:bytes_read])
+		cut = block.rfind('\n') + 1
+		if cut == 0:
+			remainder = block
+			continue
+		remainder = block[cut:]
+		yield block[:cut]
+	if len(remainder) > 0:
+		yield remainder
 
-def saveVariableToPickle(variableToStore, outdir, prefix):
-	pickleFile = os.path.join(outdir, str(prefix + '.pkl'))
-	with open(pickleFile, 'wb') as writer:
-		pickle.dump(variableToStore, writer)
 
+# Split a text block into lines, translating the newlines like the universal newlines
+# mode used by the line engine
+def splitBlockLines(block):
+	if '\r' in block:
+		block = block.replace('\r\n', '\n').replace('\r', '\n')
+	lines = block.split('\n')
+	if len(lines[-1]) == 0:
+		lines.pop()
+	return lines
 
-def extractVariableFromPickle(pickleFile):
-	with open(pickleFile, 'rb') as reader:
-		variable = pickle.load(reader)
-	return variable
+
+starts_with_at = operator.methodcaller('startswith', '@')
+starts_with_plus = operator.methodcaller('startswith', '+')
+
+
+# Check the records of a block four lines at a time. Returns False when some record is
+# not a plain well formed record (the line engine must then take care of the block)
+def checkFastqRecords(lines, number_reads_components, statistics=None):
+	headers = lines[0::4]
+	sequences = lines[1::4]
+	pluses = lines[2::4]
+	qualities = lines[3::4]
+	if not all(map(starts_with_at, headers)) or any(map(starts_with_plus, sequences)) or not all(map(starts_with_plus, pluses)):
+		return False
+	if map(len, sequences) != map(len, qualities):
+		return False
+	number_records = len(headers)
+	for i in range(0, len(number_reads_components)):
+		number_reads_components[i] += number_records
+	if statistics is not None:
+		addStatistics(statistics, sequences, qualities)
+	return True
+
+
+def checkFastqBlocks(blocks, number_reads_components, statistics=None):
+	blocks = iter(blocks)
+	pending_lines = []
+	for block in blocks:
+		lines = pending_lines + splitBlockLines(block)
+		number_lines = len(lines) - len(lines) % 4
+		pending_lines = lines[number_lines:]
+		if not checkFastqRecords(lines[:number_lines], number_reads_components, statistics):
+			remaining_lines = itertools.chain(lines, itertools.chain.from_iterable(splitBlockLines(block) for block in blocks))
+			checkFastqLines(itertools.imap(lambda line: line + '\n', remaining_lines), number_reads_components, statistics)
+			return
+	if len(pending_lines) > 0:
+		checkFastqLines([line + '\n' for line in pending_lines], number_reads_components, statistics)
+
+
+# Error localisation: the first max_errors errors found (0 for all), with their record,
+# byte offset and type. Without full_scan, the localisation stops at max_errors
+def newValidation(max_errors, full_scan):
+	return {'max_errors': max_errors, 'full_scan': full_scan, 'errors': [], 'error_types': {}, 'number_errors': 0, 'number_records': 0, 'offset': 0, 'pending_lines': [], 'resyncing': False, 'done': False, 'scanned_all': False}
+
+
+def addValidationError(validation, error_type, offset, line):
+	validation['number_errors'] += 1
+	validation['error_types'][error_type] = validation['error_types'].get(error_type, 0) + 1
+	if validation['max_errors'] == 0 or len(validation['errors']) < validation['max_errors']:
+		validation['errors'].append([validation['number_records'] + 1, offset, error_type, line[:50]])
+	if not validation['full_scan'] and len(validation['errors']) == validation['max_errors']:
+		validation['done'] = True
+
+
+# Validate whole plain records at once. Returns False when some record has an error
+# (the records are then validated one by one to find it)
+def validateFastqRecords(lines):
+	headers = lines[0::4]
+	sequences = lines[1::4]
+	pluses = lines[2::4]
+	qualities = lines[3::4]
+	if not all(map(starts_with_at, headers)) or not all(map(starts_with_plus, pluses)):
+		return False
+	if map(len, sequences) != map(len, qualities):
+		return False
+	if len(''.join(sequences).translate(None, valid_sequence_characters)) > 0 or len(''.join(qualities).translate(None, valid_quality_characters)) > 0:
+		return False
+	return True
+
+
+# Validate the records of the raw lines (with their '\r', if any), one by one. Lines of
+# an incomplete record at the end are left for the next block (or, at the end of the
+# file, reported as a truncated record)
+def validateFastqLines(validation, raw_lines, end_of_file):
+	lines = [line[:-1] if line.endswith('\r') else line for line in raw_lines]
+	i = 0
+	while i < len(lines) and not validation['done']:
+		if not lines[i].startswith('@'):
+			# Only the first of consecutive lines out of place is reported
+			if not validation['resyncing']:
+				addValidationError(validation, "missing '@'", validation['offset'], lines[i])
+				validation['resyncing'] = True
+			validation['offset'] += len(raw_lines[i]) + 1
+			i += 1
+			continue
+		# After an error, quality lines starting with '@' are not taken as headers
+		if validation['resyncing']:
+			if len(lines) - i < 3 and not end_of_file:
+				break
+			if len(lines) - i < 3 or not lines[i + 2].startswith('+'):
+				validation['offset'] += len(raw_lines[i]) + 1
+				i += 1
+				continue
+		if len(lines) - i < 4:
+			if end_of_file:
+				addValidationError(validation, 'truncated final record', validation['offset'], lines[i])
+				validation['number_records'] += 1
+				i = len(lines)
+			break
+		validation['resyncing'] = False
+		record_offset = validation['offset']
+		if not lines[i + 2].startswith('+'):
+			addValidationError(validation, "missing '+'", record_offset + len(raw_lines[i]) + len(raw_lines[i + 1]) + 2, lines[i + 2])
+			validation['number_records'] += 1
+			validation['resyncing'] = True
+			validation['offset'] += len(raw_lines[i]) + 1
+			i += 1
+			continue
+		if len(lines[i + 1]) != len(lines[i + 3]):
+			addValidationError(validation, 'length mismatch', record_offset + len(raw_lines[i]) + len(raw_lines[i + 1]) + len(raw_lines[i + 2]) + 3, lines[i + 3])
+		elif len(lines[i + 1].translate(None, valid_sequence_characters)) > 0:
+			addValidationError(validation, 'invalid sequence characters', record_offset + len(raw_lines[i]) + 1, lines[i + 1])
+		elif len(lines[i + 3].translate(None, valid_quality_characters)) > 0:
+			addValidationError(validation, 'invalid quality characters', record_offset + len(raw_lines[i]) + len(raw_lines[i + 1]) + len(raw_lines[i + 2]) + 3, lines[i + 3])
+		validation['number_records'] += 1
+		validation['offset'] += len(raw_lines[i]) + len(raw_lines[i + 1]) + len(raw_lines[i + 2]) + len(raw_lines[i + 3]) + 4
+		i += 4
+	validation['pending_lines'] = raw_lines[i:]
+
+
+def validateFastqBlock(validation, block):
+	raw_lines = validation['pending_lines'] + block.split('\n')
+	if block.endswith('\n'):
+		raw_lines.pop()
+	number_lines = len(raw_lines) - len(raw_lines) % 4
+	if not validation['resyncing'] and number_lines > 0:
+		lines = raw_lines[:number_lines]
+		if '\r' in block:
+			lines = [line[:-1] if line.endswith('\r') else line for line in lines]
+		if validateFastqRecords(lines):
+			validation['number_records'] += number_lines / 4
+			validation['offset'] += sum(map(len, raw_lines[:number_lines])) + number_lines
+			raw_lines = raw_lines[number_lines:]
+	validateFastqLines(validation, raw_lines, False)
+
+
+# Pass the blocks on while they are validated
+def validatedFastqBlocks(blocks, validation):
+	for block in blocks:
+		if not validation['done']:
+			with instrumentation.timedStage('locate_errors') as stage:
+				validateFastqBlock(validation, block)
+				stage['bytes'] += len(block)
+		yield block
+	if not validation['done']:
+		validateFastqLines(validation, validation['pending_lines'], True)
+	validation['scanned_all'] = not validation['done']
 
 
 # Check whether a fastq file have all the required fields
-def checkFastqFile(fastq, outdir):
+# Returns the counts, the statistics and the errors found (None when not asked)
+def checkFastqFile(fastq, engine, get_statistics=False, validation_settings=None, blocks_filter=None):
 	number_reads_components = [0, 0, 0, 0]
-	with open(fastq, 'rtU') as reader:
-		plus_line = True
-		quality_line = True
-		length_sequence = 0
-		for line in reader:
-			if len(line) > 0:
-				if line.startswith('@') and plus_line and quality_line:
-					number_reads_components[0] += 1
-					plus_line = False
-					quality_line = False
-					length_sequence = 0
-				elif line.startswith('+') and not plus_line:
-					number_reads_components[2] += 1
-					plus_line = True
-				elif plus_line and not quality_line:
-					line = line.splitlines()[0]
-					if len(line) != length_sequence:
-						print 'Sequence length and quality length are not equal!'
-						break
-					else:
-						quality_line = True
-						number_reads_components[3] += 1
-				else:
-					number_reads_components[1] += 1
-					line = line.splitlines()[0]
-					length_sequence = len(line)
+	statistics = newStatistics() if get_statistics else None
+	validation = newValidation(*validation_settings) if validation_settings is not None else None
+	# Includes the read, statistics and locate_errors stages
+	with instrumentation.timedStage('check_file') as stage:
+		with fastqio.openFastq(fastq, engine != 'line') as reader:
+			if engine == 'line':
+				checkFastqLines(universalNewlineLines(reader), number_reads_components, statistics)
+			else:
+				blocks = readFastqBlocks(reader, block_size)
+				if validation is not None:
+					blocks = validatedFastqBlocks(blocks, validation)
+				if blocks_filter is not None:
+					blocks = blocks_filter(blocks)
+				checkFastqBlocks(blocks, number_reads_components, statistics)
+				# The check stops at the first length mismatch, the localisation may not
+				if validation is not None and not validation['done']:
+					for block in blocks:
+						pass
+		if (validation is not None or blocks_filter is not None) and engine == 'line':
+			with fastqio.openFastq(fastq, True) as reader:
+				blocks = readFastqBlocks(reader, block_size)
+				if validation is not None:
+					blocks = validatedFastqBlocks(blocks, validation)
+				if blocks_filter is not None:
+					blocks = blocks_filter(blocks)
+				for block in blocks:
+					pass
+		stage['bytes'] += os.path.getsize(fastq)
+		stage['records'] += number_reads_components[0]
+	return number_reads_components, statistics, validation
+
+
+# Read name of a header line, without the mate suffix (/1 or /2) or the Casava comment
+# (as in @name 1:N:0:ATCACG)
+def recordName(header):
+	name = header[1:].split(None, 1)[0] if len(header) > 1 else ''
+	if name.endswith('/1') or name.endswith('/2'):
+		name = name[:-2]
+	return name
+
+
+# Paired mode: queue the read names of the records of each block and pass the block on
+def queueRecordNames(blocks, name_queue):
+	# Lines already seen, blank ones included (the sequence and quality of empty reads)
+	number_lines = 0
+	for block in blocks:
+		lines = splitBlockLines(block)
+		name_queue.put(map(recordName, lines[-number_lines % 4::4]))
+		number_lines += len(lines)
+		yield block
+
+
+# Check one mate of a pair (on its own thread), sending its read names to name_queue
+# (None at the end, even if the check failed)
+def checkPairMate(fastq, engine, get_statistics, validation_settings, name_queue, results, mate, errors):
+	try:
+		with instrumentation.profiled():
+			results[mate] = checkFastqFile(fastq, engine, get_statistics, validation_settings, lambda blocks: queueRecordNames(blocks, name_queue))
+	except (Exception, SystemExit):
+		errors.append(traceback.format_exc())
+	finally:
+		name_queue.put(None)
+
+
+# Compare the read names of both mates as they arrive
+# Returns the number of concordant pairs and the first discordant record (number and names)
+def compareRecordNames(name_queues):
+	pending = [[], []]
+	ended = [False, False]
+	number_pairs = 0
+	first_discordant = None
+	while not all(ended):
+		mate = 0 if ended[1] or (not ended[0] and len(pending[0]) <= len(pending[1])) else 1
+		names = name_queues[mate].get()
+		if names is None:
+			ended[mate] = True
+			continue
+		if first_discordant is not None:
+			continue
+		pending[mate].extend(names)
+		number_names = min(len(pending[0]), len(pending[1]))
+		if number_names == 0:
+			continue
+		if pending[0][:number_names] != pending[1][:number_names]:
+			i = next(i for i in range(0, number_names) if pending[0][i] != pending[1][i])
+			number_pairs += i
+			first_discordant = [number_pairs + 1, pending[0][i], pending[1][i]]
+			pending = [[], []]
+		else:
+			number_pairs += number_names
+			del pending[0][:number_names]
+			del pending[1][:number_names]
+	if first_discordant is None and (len(pending[0]) > 0 or len(pending[1]) > 0):
+		first_discordant = [number_pairs + 1, pending[0][0] if len(pending[0]) > 0 else None, pending[1][0] if len(pending[1]) > 0 else None]
+	return {'concordant_pairs': number_pairs, 'first_discordant': first_discordant}
+
+
+# Check a pair of fastq files in a single pass, one thread for each mate
+def checkFastqPair(fastq_1, fastq_2, engine, get_statistics=False, validation_settings=None):
+	name_queues = [Queue.Queue(pair_queue_size), Queue.Queue(pair_queue_size)]
+	results = [None, None]
+	errors = []
+	threads = [threading.Thread(target=checkPairMate, args=(fastq, engine, get_statistics, validation_settings, name_queue, results, mate, errors,)) for mate, fastq, name_queue in zip([0, 1], [fastq_1, fastq_2], name_queues)]
+	with instrumentation.timedStage('check_pair') as stage:
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		pair_result = compareRecordNames(name_queues)
+		for thread in threads:
+			thread.join()
+		stage['records'] += pair_result['concordant_pairs']
+	if len(errors) > 0:
+		raise IOError('It was not possible to check the pair ' + fastq_1 + ' ' + fastq_2 + '\n' + errors[0])
+	return results[0], results[1], pair_result
+
+
+# Split an uncompressed fastq file into byte ranges to be checked in parallel
+# (returns None if the file should be checked as a whole)
+def fastqByteRanges(fastq, engine, threads, range_size):
+	if engine == 'line' or threads < 2 or range_size <= 0 or fastqio.compressionType(fastq) is not None:
+		return None
+	file_size = os.path.getsize(fastq)
+	if file_size < 2 * min_range_size:
+		return None
+	number_ranges = max(threads, -(-file_size // range_size))
+	number_ranges = min(number_ranges, file_size // min_range_size)
+	step = -(-file_size // number_ranges)
+	return [[start, min(start + step, file_size)] for start in range(0, file_size, step)]
+
+
+# Find the offset of the first record starting at or after start. A quality line can
+# start with '@', so a line is only taken as a header when the three lines after it
+# look like the rest of a record and the following line is again a header
+def findRecordStart(reader, start):
+	window = 1024 * 1024
+	while True:
+		reader.seek(start - 1)
+		data = reader.read(window)
+		at_eof = len(data) < window
+		first_line = data.find('\n') + 1
+		if first_line == 0:
+			if at_eof:
+				return start - 1 + len(data)
+		else:
+			lines = data[first_line:].split('\n')
+			offset = start - 1 + first_line
+			for i in range(0, len(lines) - 3):
+				if lines[i].startswith('@') and lines[i + 2].startswith('+') and not lines[i + 1].startswith('+') and len(lines[i + 1]) == len(lines[i + 3]):
+					if i + 4 == len(lines):
+						if at_eof:
+							return offset
+					elif lines[i + 4].startswith('@') or (at_eof and i + 4 == len(lines) - 1 and len(lines[i + 4]) == 0):
+						return offset
+				offset += len(lines[i]) + 1
+			if at_eof:
+				return start - 1 + len(data)
+		if window >= max_sync_window:
+			return None
+		window *= 2
+
+
+# Check the records whose header starts inside the [start, end) byte range, with the block engine
+# The counts are None when the range is not made of plain records only
+def checkFastqRange(fastq, start, end, get_statistics=False):
+	with instrumentation.timedStage('check_range') as stage:
+		range_result = checkFastqRangeRecords(fastq, start, end, get_statistics)
+		stage['bytes'] += end - start
+		if range_result[1] is not None:
+			stage['records'] += range_result[1][0]
+	return range_result
+
+
+def checkFastqRangeRecords(fastq, start, end, get_statistics):
+	number_reads_components = [0, 0, 0, 0]
+	statistics = newStatistics() if get_statistics else None
+	with io.open(fastq, 'rb', buffering=0) as reader:
+		first_record = findRecordStart(reader, start) if start > 0 else 0
+		if first_record is None:
+			return [start, end], None, None, None, None
+		reader.seek(first_record)
+		offset = first_record
+		pending = ''
+		for block in readFastqBlocks(reader, block_size):
+			if offset >= end:
+				break
+			data = pending + block
+			if '\r' in data:
+				return [start, end], None, first_record, None, None
+			lines = data.split('\n')
+			if len(lines[-1]) == 0:
+				lines.pop()
+			number_lines = len(lines) - len(lines) % 4
+			pending_lines = lines[number_lines:]
+			pending = ''.join([line + '\n' for line in pending_lines])
+			records_size = len(data) - len(pending)
+			if offset + records_size > end:
+				number_lines = 0
+				record_offset = offset
+				while number_lines < len(lines) - len(pending_lines) and record_offset < end:
+					record_offset += len(lines[number_lines]) + len(lines[number_lines + 1]) + len(lines[number_lines + 2]) + len(lines[number_lines + 3]) + 4
+					number_lines += 4
+				records_size = record_offset - offset
+			if not checkFastqRecords(lines[:number_lines], number_reads_components, statistics):
+				return [start, end], None, first_record, None, None
+			offset += records_size
+		if len(pending) > 0 and offset < end:
+			return [start, end], None, first_record, None, None
+		# The last line of the file may have no newline
+		offset = min(offset, os.fstat(reader.fileno()).st_size)
+	return [start, end], number_reads_components, first_record, offset, statistics
+
+
+# Sum the counts of the byte ranges of a file (None unless they cover it as a single pass would)
+def reduceFastqRanges(ranges_results):
+	ranges_results = sorted(ranges_results, key=lambda range_result: range_result[0])
+	number_reads_components = [0, 0, 0, 0]
+	statistics = None
+	previous_stop = 0
+	for byte_range, range_components, first_record, stop, range_statistics in ranges_results:
+		if range_components is None or first_record != previous_stop:
+			return None
+		for i in range(0, len(number_reads_components)):
+			number_reads_components[i] += range_components[i]
+		if range_statistics is not None:
+			if statistics is None:
+				statistics = newStatistics()
+			mergeStatistics(statistics, range_statistics)
+		previous_stop = stop
+	return number_reads_components, statistics
+
+
+# Fast fingerprint of the content of a file: md5 of its first and last bytes
+def fastqFingerprint(fastq, size):
+	md5 = hashlib.md5()
+	with open(fastq, 'rb') as reader:
+		md5.update(reader.read(fingerprint_size))
+		if size > fingerprint_size:
+			reader.seek(max(fingerprint_size, size - fingerprint_size))
+			md5.update(reader.read(fingerprint_size))
+	return md5.hexdigest()
+
+
+# A file is taken as unchanged when its size, mtime and fingerprint are the ones of its
+# ledger entry
+def fastqLedgerKey(fastq):
+	file_stat = os.stat(fastq)
+	return [file_stat.st_size, file_stat.st_mtime, fastqFingerprint(fastq, file_stat.st_size)]
+
+
+def openLedger(ledger_file):
+	connection = sqlite3.connect(ledger_file, timeout=60)
+	connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT NOT NULL PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, fingerprint TEXT NOT NULL, number_reads INTEGER NOT NULL, well_formatted INTEGER NOT NULL, result BLOB NOT NULL, checked REAL NOT NULL)')
+	connection.execute('CREATE TABLE IF NOT EXISTS pairs (path_1 TEXT NOT NULL, path_2 TEXT NOT NULL, keys BLOB NOT NULL, concordant INTEGER NOT NULL, result BLOB NOT NULL, checked REAL NOT NULL, PRIMARY KEY (path_1, path_2))')
+	connection.commit()
+	return connection
+
+
+# Result of fastq in the ledger ([number_reads_components, statistics, validation]), if
+# the file did not change and the result has what is asked (the statistics, and the
+# errors localised with the same settings). What was not asked is left out
+def ledgerResult(ledger, fastq, ledger_key, get_statistics, validation_settings):
+	row = ledger.execute('SELECT size, mtime, fingerprint, result FROM files WHERE path = ?', (fastq,)).fetchone()
+	if row is None or [row[0], row[1], str(row[2])] != ledger_key:
+		return None
+	number_reads_components, statistics, validation = pickle.loads(str(row[3]))
+	if get_statistics and statistics is None:
+		return None
+	if validation_settings is not None and (validation is None or [validation['max_errors'], validation['full_scan']] != validation_settings):
+		return None
+	return [number_reads_components, statistics if get_statistics else None, validation if validation_settings is not None else None]
+
+
+def ledgerStore(ledger, fastq, ledger_key, number_reads_components, statistics, validation):
+	well_formatted = number_reads_components[0] == number_reads_components[1] == number_reads_components[2] == number_reads_components[3]
+	ledger.execute('INSERT OR REPLACE INTO files (path, size, mtime, fingerprint, number_reads, well_formatted, result, checked) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (fastq, ledger_key[0], ledger_key[1], ledger_key[2], number_reads_components[0], well_formatted, sqlite3.Binary(pickle.dumps([number_reads_components, statistics, validation], pickle.HIGHEST_PROTOCOL)), time.time()))
+	ledger.commit()
+
+
+# Result of a pair in the ledger (see compareRecordNames), if both mates did not change
+def ledgerPairResult(ledger, fastq_1, fastq_2, ledger_keys):
+	row = ledger.execute('SELECT keys, result FROM pairs WHERE path_1 = ? AND path_2 = ?', (fastq_1, fastq_2)).fetchone()
+	if row is None or pickle.loads(str(row[0])) != ledger_keys:
+		return None
+	return pickle.loads(str(row[1]))
+
+
+def ledgerPairStore(ledger, fastq_1, fastq_2, ledger_keys, pair_result):
+	ledger.execute('INSERT OR REPLACE INTO pairs (path_1, path_2, keys, concordant, result, checked) VALUES (?, ?, ?, ?, ?, ?)', (fastq_1, fastq_2, sqlite3.Binary(pickle.dumps(ledger_keys, pickle.HIGHEST_PROTOCOL)), pair_result['first_discordant'] is None, sqlite3.Binary(pickle.dumps(pair_result, pickle.HIGHEST_PROTOCOL)), time.time()))
+	ledger.commit()
+
+
+statistics_columns = [['numberBases', 'number_bases'], ['GC_percent', 'gc_percent'], ['N_percent', 'n_percent'], ['minReadLength', 'min_length'], ['meanReadLength', 'mean_length'], ['maxReadLength', 'max_length'], ['meanQuality', 'mean_quality']]
+
+
+# Write the result of a file to the report (and its statistics and errors files)
+def writeFastqResult(writer, fastq, number_reads_components, statistics, validation, outdir):
+	with instrumentation.timedStage('report'):
+		writeFastqResultFiles(writer, fastq, number_reads_components, statistics, validation, outdir)
+
+
+def writeFastqResultFiles(writer, fastq, number_reads_components, statistics, validation, outdir):
 	print fastq + ' -> ' + str(number_reads_components)
-	saveVariableToPickle([os.path.basename(fastq), number_reads_components[0], number_reads_components[0] == number_reads_components[1] == number_reads_components[2] == number_reads_components[3]], outdir, os.path.basename(fastq))
+	row = [os.path.basename(fastq), number_reads_components[0], number_reads_components[0] == number_reads_components[1] == number_reads_components[2] == number_reads_components[3]]
+	if statistics is not None:
+		summary = summariseStatistics(statistics)
+		row.extend(['NA' if summary[key] is None else summary[key] for column, key in statistics_columns])
+		with open(os.path.join(outdir, os.path.basename(fastq) + '.statistics.json'), 'wt') as writer_json:
+			json.dump(summary, writer_json, indent=1, sort_keys=True)
+	if validation is not None:
+		number_errors = str(validation['number_errors']) + ('' if validation['scanned_all'] else '+')
+		first_error = 'NA'
+		if len(validation['errors']) > 0:
+			first_error = validation['errors'][0][2] + ' (record ' + str(validation['errors'][0][0]) + ', byte ' + str(validation['errors'][0][1]) + ')'
+			print '  ' + number_errors + ' errors, first: ' + first_error
+		row.extend([number_errors, first_error])
+		with open(os.path.join(outdir, os.path.basename(fastq) + '.errors.tab'), 'wt') as writer_errors:
+			writer_errors.write('\t'.join(['#record', 'byte_offset', 'error', 'line_start']) + '\n')
+			for error in validation['errors']:
+				writer_errors.write('\t'.join(map(str, error)) + '\n')
+			writer_errors.write('# ' + str(validation['number_errors']) + ' errors in ' + str(validation['number_records']) + ' records' + ('' if validation['scanned_all'] else ' (the localisation stopped before the end of the file)') + ': ' + ', '.join(error_type + ' ' + str(count) for error_type, count in sorted(validation['error_types'].items())) + '\n')
+	writer.write('\t'.join(map(str, row)) + '\n')
+	writer.flush()
+
+
+def reportHeader(get_statistics, validation_settings):
+	header = ['#file', 'numberReads', 'fastq_well_formatted']
+	if get_statistics:
+		header.extend([column for column, key in statistics_columns])
+	if validation_settings is not None:
+		header.extend(['numberErrors', 'firstError'])
+	return header
+
+
+# Write the results of both mates of a pair to the report and the result of the pair to
+# the pairs report
+def writePairResult(writer, writer_pairs, fastq_1, fastq_2, result_1, result_2, pair_result, outdir):
+	writeFastqResult(writer, fastq_1, result_1[0], result_1[1], result_1[2], outdir)
+	writeFastqResult(writer, fastq_2, result_2[0], result_2[1], result_2[2], outdir)
+	first_discordant = 'NA'
+	if pair_result['first_discordant'] is not None:
+		record, name_1, name_2 = pair_result['first_discordant']
+		first_discordant = 'record ' + str(record) + ': ' + (name_1 if name_1 is not None else 'missing') + ' / ' + (name_2 if name_2 is not None else 'missing')
+		print '  pair not concordant, first discordant ' + first_discordant
+	writer_pairs.write('\t'.join(map(str, [os.path.basename(fastq_1), os.path.basename(fastq_2), result_1[0][0], result_2[0][0], result_1[0][0] == result_2[0][0], pair_result['first_discordant'] is None, pair_result['concordant_pairs'], first_discordant])) + '\n')
+	writer_pairs.flush()
+
+
+# Paired mode: each pair is checked in a single pass (see checkFastqPair), the mates
+# going to report.number_reads.tab and the pairs to report.pairs.tab. Returns the files
+# that could not be checked
+def runCheckFastqPairs(args, pairs, validation_settings, outdir):
+	ledger = openLedger(os.path.join(outdir, ledger_file_name))
+	ledger_results = []
+	ledger_keys = {}
+	tasks = []
+	for fastq_1, fastq_2 in pairs:
+		pair_keys = [fastqLedgerKey(fastq_1), fastqLedgerKey(fastq_2)]
+		result = None
+		if not args.recheck:
+			result = [ledgerResult(ledger, os.path.abspath(fastq), ledger_key, args.statistics, validation_settings) for fastq, ledger_key in zip([fastq_1, fastq_2], pair_keys)]
+			result.append(ledgerPairResult(ledger, os.path.abspath(fastq_1), os.path.abspath(fastq_2), pair_keys))
+		if result is None or None in result:
+			ledger_keys[(fastq_1, fastq_2)] = pair_keys
+			tasks.append((checkFastqPair, (fastq_1, fastq_2, args.engine, args.statistics, validation_settings,)))
+		else:
+			ledger_results.append([fastq_1, fastq_2, result])
+	if len(ledger_results) > 0:
+		print str(len(ledger_results)) + ' pairs unchanged since they were checked, ' + str(len(tasks)) + ' pairs to check' + '\n'
+
+	files_with_errors = []
+	with open(os.path.join(outdir, 'report.number_reads.tab'), 'wt') as writer, open(os.path.join(outdir, 'report.pairs.tab'), 'wt') as writer_pairs:
+		writer.write('\t'.join(reportHeader(args.statistics, validation_settings)) + '\n')
+		writer_pairs.write('\t'.join(['#fastq_1', 'fastq_2', 'numberReads_1', 'numberReads_2', 'same_number_reads', 'names_concordant', 'numberConcordantPairs', 'firstDiscordantRecord']) + '\n')
+
+		for fastq_1, fastq_2, result in ledger_results:
+			writePairResult(writer, writer_pairs, fastq_1, fastq_2, result[0], result[1], result[2], outdir)
+
+		pool = multiprocessing.Pool(processes=args.threads)
+		for task, result, error, task_instrumentation in pool.imap_unordered(instrumentation.runPoolTask, tasks):
+			instrumentation.mergeInstrumentation(task_instrumentation)
+			fastq_1, fastq_2 = task[1][:2]
+			if error is not None:
+				print 'It was not possible to check ' + fastq_1 + ' and ' + fastq_2 + '\n' + error
+				files_with_errors.extend([fastq_1, fastq_2])
+				continue
+			writePairResult(writer, writer_pairs, fastq_1, fastq_2, result[0], result[1], result[2], outdir)
+			pair_keys = ledger_keys[(fastq_1, fastq_2)]
+			for fastq, ledger_key, mate_result in zip([fastq_1, fastq_2], pair_keys, result[:2]):
+				ledgerStore(ledger, os.path.abspath(fastq), ledger_key, mate_result[0], mate_result[1], mate_result[2])
+			ledgerPairStore(ledger, os.path.abspath(fastq_1), os.path.abspath(fastq_2), pair_keys, result[2])
+		pool.close()
+		pool.join()
+	ledger.close()
+	return files_with_errors
 
 
 def runCheckFastq(args):
@@ -57,21 +782,80 @@ def runCheckFastq(args):
 	inputFastqFiles = args.inputFastqFiles
 	for i in range(0, len(inputFastqFiles)):
 		inputFastqFiles[i] = inputFastqFiles[i].name
-	pool = multiprocessing.Pool(processes=threads)
+
+	validation_settings = [args.maxErrors, args.fullScan] if args.locateErrors else None
+
+	if args.paired:
+		files_with_errors = runCheckFastqPairs(args, zip(inputFastqFiles[0::2], inputFastqFiles[1::2]), validation_settings, outdir)
+		if len(files_with_errors) > 0:
+			sys.exit('It was not possible to check ' + str(len(files_with_errors)) + ' fastq files: ' + ', '.join(files_with_errors))
+		return
+
+	# Files unchanged since they were checked go to the report from the ledger
+	ledger = openLedger(os.path.join(outdir, ledger_file_name))
+	ledger_keys = {}
+	ledger_results = []
+	files_to_check = []
 	for fastq in inputFastqFiles:
-		pool.apply_async(checkFastqFile, args=(fastq, outdir,))
-	pool.close()
-	pool.join()
+		ledger_key = fastqLedgerKey(fastq)
+		result = ledgerResult(ledger, os.path.abspath(fastq), ledger_key, args.statistics, validation_settings) if not args.recheck else None
+		if result is None:
+			ledger_keys[fastq] = ledger_key
+			files_to_check.append(fastq)
+		else:
+			ledger_results.append([fastq, result])
+	if len(ledger_results) > 0:
+		print str(len(ledger_results)) + ' fastq files unchanged since they were checked, ' + str(len(files_to_check)) + ' fastq files to check' + '\n'
+
+	tasks = []
+	split_files = {}
+	for fastq in files_to_check:
+		# The errors are localised in a single pass over the whole file
+		byte_ranges = fastqByteRanges(fastq, args.engine, threads, args.rangeSize * 1024 * 1024) if validation_settings is None else None
+		if byte_ranges is None:
+			tasks.append((checkFastqFile, (fastq, args.engine, args.statistics, validation_settings,)))
+		else:
+			split_files[fastq] = [len(byte_ranges), []]
+			for start, end in byte_ranges:
+				tasks.append((checkFastqRange, (fastq, start, end, args.statistics,)))
 
+	files_with_errors = []
 	with open(os.path.join(outdir, 'report.number_reads.tab'), 'wt') as writer:
-		writer.write('#file' + '\t' + 'numberReads' + '\t' + 'fastq_well_formatted' + '\n')
-		files = [f for f in os.listdir(outdir) if not f.startswith('.') and os.path.isfile(os.path.join(outdir, f))]
-		for file_found in files:
-			if file_found.endswith('.pkl'):
-				file_path = os.path.join(outdir, file_found)
-				sampleINFO = extractVariableFromPickle(file_path)
-				writer.write('\t'.join(map(str, sampleINFO)) + '\n')
-				os.remove(file_path)
+		writer.write('\t'.join(reportHeader(args.statistics, validation_settings)) + '\n')
+
+		for fastq, result in ledger_results:
+			writeFastqResult(writer, fastq, result[0], result[1], result[2], outdir)
+
+		# Files whose ranges could not be put together are checked again as a whole
+		while len(tasks) > 0:
+			files_to_recheck = []
+			pool = multiprocessing.Pool(processes=threads)
+			for task, result, error, task_instrumentation in pool.imap_unordered(instrumentation.runPoolTask, tasks):
+				instrumentation.mergeInstrumentation(task_instrumentation)
+				fastq = task[1][0]
+				if error is not None:
+					print 'It was not possible to check ' + fastq + '\n' + error
+					if fastq not in files_with_errors:
+						files_with_errors.append(fastq)
+				elif task[0] == checkFastqRange:
+					split_files[fastq][1].append(result)
+					if len(split_files[fastq][1]) == split_files[fastq][0]:
+						reduced = reduceFastqRanges(split_files[fastq][1])
+						if reduced is None:
+							files_to_recheck.append(fastq)
+						else:
+							writeFastqResult(writer, fastq, reduced[0], reduced[1], None, outdir)
+							ledgerStore(ledger, os.path.abspath(fastq), ledger_keys[fastq], reduced[0], reduced[1], None)
+				else:
+					writeFastqResult(writer, fastq, result[0], result[1], result[2], outdir)
+					ledgerStore(ledger, os.path.abspath(fastq), ledger_keys[fastq], result[0], result[1], result[2])
+			pool.close()
+			pool.join()
+			tasks = [(checkFastqFile, (fastq, args.engine, args.statistics, validation_settings,)) for fastq in files_to_recheck]
+	ledger.close()
+
+	if len(files_with_errors) > 0:
+		sys.exit('It was not possible to check ' + str(len(files_with_errors)) + ' fastq files: ' + ', '.join(files_with_errors))
 
 
 def main():
@@ -80,16 +864,33 @@ def main():
 	parser.add_argument('--version', help='Version information', action='version', version=str('%(prog)s v' + version))
 
 	parser_required = parser.add_argument_group('Required options')
-	parser_required.add_argument('-i', '--inputFastqFiles', nargs='+', type=argparse.FileType('r'), metavar='/path/to/reference/genome/fastq/file.fq', help='Path to uncompressed FASTQ file or files (if more than one are provided, they must be separated by space)', required=True)
+	parser_required.add_argument('-i', '--inputFastqFiles', nargs='+', type=argparse.FileType('r'), metavar='/path/to/reference/genome/fastq/file.fq', help='Path to FASTQ file or files, uncompressed or compressed with gzip or bzip2 (if more than one are provided, they must be separated by space)', required=True)
 	parser_optional = parser.add_argument_group('Facultative options')
 	parser_optional.add_argument('-o', '--outdir', type=str, metavar='/output/directory/', help='Path for output directory', required=False, default='.')
 	parser_optional.add_argument('-j', '--threads', metavar=('N'), type=int, help='Number of threads to be used', required=False, default=1)
+	parser_optional.add_argument('--engine', choices=['block', 'line'], help='Validation engine to use: "block" checks the records over big binary blocks, "line" is the original line by line check', required=False, default='block')
+	parser_optional.add_argument('--statistics', action='store_true', help='Also get, in the same pass, the base counts, GC and N content, read lengths and quality histogram of each file (summary in extra columns of report.number_reads.tab and full statistics in <file>.statistics.json)')
+	parser_optional.add_argument('--locateErrors', action='store_true', help='Also localise the errors of each file (record number, byte offset and type: missing @, missing +, length mismatch, invalid characters or truncated final record), in the same pass (number of errors and first error in extra columns of report.number_reads.tab and the errors in <file>.errors.tab)')
+	parser_optional.add_argument('--maxErrors', metavar=('N'), type=int, help='With --locateErrors, number of errors kept for each file (0 keeps all). Without --fullScan, the localisation stops at the first N errors', required=False, default=10)
+	parser_optional.add_argument('--fullScan', action='store_true', help='With --locateErrors, go through the whole file even after --maxErrors errors, counting all the errors by type')
+	parser_optional.add_argument('--paired', action='store_true', help='The fastq files are pairs of mate 1 and mate 2 files, given one pair after the other (as in -i a_1.fq a_2.fq b_1.fq b_2.fq). Both mates of a pair are read together and, in the same pass, besides the check of each file, their number of reads and read names (without /1 and /2 or Casava comments) are compared (results in report.pairs.tab, with the first discordant record). Requires the block engine')
+	parser_optional.add_argument('--recheck', action='store_true', help='Check all the fastq files again, even the ones unchanged (same size, modification time and fingerprint of the content) since their result was stored in the ledger of outdir (checkFastqFiles.ledger.sqlite)')
+	parser_optional.add_argument('--profile', action='store_true', help='Profile the checks with cProfile (all processes together in checkFastqFiles.profile.pstats and the top functions in checkFastqFiles.profile.txt, in outdir)')
+	parser_optional.add_argument('--rangeSize', metavar=('N'), type=int, help='With more than one thread, uncompressed fastq files are split into byte ranges of at most N MB (and at least one range per thread) that are checked in parallel (0 disables the splitting)', required=False, default=256)
 
 	parser.set_defaults(func=runCheckFastq)
 
 	args = parser.parse_args()
 
-	args.func(args)
+	if args.paired and len(args.inputFastqFiles) % 2 != 0:
+		parser.error('--paired requires an even number of fastq files (mate 1 and mate 2 of each pair)')
+	# The line engine would read each mate a second time for its read names
+	if args.paired and args.engine == 'line':
+		parser.error('--paired requires the block engine')
+
+	# Timings of each stage go to checkFastqFiles.instrumentation.json in outdir
+	outdir = os.path.abspath(args.outdir)
+	instrumentation.runInstrumented(args.func, (args,), outdir, 'checkFastqFiles.py', version, args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+fastqio.py - Reading of plain and compressed fastq files shared by the scripts
+<https://github.com/miguelpmachado/pythonScripts>
+
+Copyright (C) 2026 Miguel Machado <mpmachado@medicina.ulisboa.pt>
+
+Last modified: October 18, 2026
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import io
+import contextlib
+import subprocess
+import threading
+import distutils.spawn
+import signal
+import errno
+import gzip
+import bz2
+
+
+# External decompressors for each compression type, the parallel ones first
+decompressors = {'gzip': ['pigz', 'gzip'], 'bzip2': ['pbzip2', 'bzip2']}
+# Bytes decompressed at a time by the in-process decompression
+decompress_block_size = 8 * 1024 * 1024
+
+
+def compressionType(file_to_test):
+	magic_dict = {'\x1f\x8b\x08': ['gzip', 'gunzip'], '\x42\x5a\x68': ['bzip2', 'bunzip2']}
+
+	max_len = max(len(x) for x in magic_dict)
+
+	with open(file_to_test, 'r') as reader:
+		file_start = reader.read(max_len)
+
+	for magic, filetype in magic_dict.items():
+		if file_start.startswith(magic):
+			return filetype
+	return None
+
+
+def restoreSigpipe():
+	signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def findProgram(programs):
+	for program in programs:
+		program_path = distutils.spawn.find_executable(program)
+		if program_path is not None:
+			return program_path
+	return None
+
+
+# In-process decompression (used when no external decompressor is found), run from
+# a separate thread that feeds the decompressed data into a pipe
+def decompressToPipe(compressed_file, compression, writer, errors):
+	opener = gzip.open if compression == 'gzip' else bz2.BZ2File
+	try:
+		with opener(compressed_file, 'rb') as reader:
+			while True:
+				data = reader.read(decompress_block_size)
+				if not data:
+					break
+				writer.write(data)
+	except IOError as e:
+		if e.errno != errno.EPIPE:
+			errors.append(e)
+	except Exception as e:
+		errors.append(e)
+	finally:
+		try:
+			writer.close()
+		except IOError:
+			pass
+
+
+# Open a fastq file for reading. Compressed files (detected by their magic bytes) are
+# streamed through a decompressor running in a separate process (or thread), so that
+# the decompression overlaps with the parsing
+@contextlib.contextmanager
+def openFastq(fastq, binary):
+	compression = compressionType(fastq)
+	if compression is None:
+		if binary:
+			reader = io.open(fastq, 'rb', buffering=0)
+		else:
+			reader = open(fastq, 'rtU')
+		with reader:
+			yield reader
+		return
+
+	decompressor = findProgram(decompressors[compression[0]])
+	if decompressor is not None:
+		proc = subprocess.Popen([decompressor, '-dc', fastq], stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=restoreSigpipe)
+		try:
+			yield proc.stdout
+		finally:
+			proc.stdout.close()
+			stderr = proc.stderr.read()
+			proc.stderr.close()
+			proc.wait()
+		if proc.returncode not in (0, -signal.SIGPIPE):
+			raise IOError('It was not possible to decompress ' + fastq + ': ' + stderr.strip())
+	else:
+		pipe_reader, pipe_writer = os.pipe()
+		reader = os.fdopen(pipe_reader, 'rb')
+		errors = []
+		thread = threading.Thread(target=decompressToPipe, args=(fastq, compression[0], os.fdopen(pipe_writer, 'wb'), errors,))
+		thread.daemon = True
+		thread.start()
+		try:
+			yield reader
+		finally:
+			reader.close()
+			thread.join()
+		if len(errors) > 0:
+			raise IOError('It was not possible to decompress ' + fastq + ': ' + str(errors[0]))
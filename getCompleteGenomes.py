@@ -9,7 +9,7 @@ getCompleteGenomes.py - Get Bacterial Complete Genomes from NCBI
 
 Copyright (C) 2016 Miguel Machado <mpmachado@medicina.ulisboa.pt>
 
-Last modified: August 05, 2016
+Last modified: October 18, 2026
 
 This program is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
@@ -28,47 +28,34 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import multiprocessing
 import argparse
-import shlex
-import subprocess
-from threading import Timer
+import threading
+import Queue
 import time
 import os.path
-import pickle
 import sys
 import urllib
+import sqlite3
+import pickle
+import httplib
+import urlparse
+import socket
+import random
+import hashlib
+import zlib
+import gzip
+import json
+
+import instrumentation
+import lookupcache
 
 version = '0.1'
 
+# Connections of the download workers (one per worker process, see initDownloader)
+downloader = None
 
-def runCommandPopenCommunicate(command, shell_True, timeout_sec_None):
-	run_successfully = False
-	if isinstance(command, basestring):
-		command = shlex.split(command)
-	else:
-		command = shlex.split(' '.join(command))
-
-	print 'Running: ' + ' '.join(command)
-	if shell_True:
-		command = ' '.join(command)
-		proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-	else:
-		proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	if timeout_sec_None is None:
-		stdout, stderr = proc.communicate()
-	else:
-		timer = Timer(timeout_sec_None, proc.kill)
-		timer.start()
-		stdout, stderr = proc.communicate()
-		timer.cancel()
-
-	if proc.returncode == 0:
-		run_successfully = True
-	else:
-		print 'STDOUT'
-		print stdout.decode("utf-8")
-		print 'STDERR'
-		print stderr.decode("utf-8")
-	return run_successfully, stdout, stderr
+eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# Number of accessions resolved by each E-utilities request
+eutils_batch_size = 200
 
 
 def check_create_directory(directory):
@@ -76,8 +63,10 @@ def check_create_directory(directory):
 		os.makedirs(directory)
 
 
-def retreiveSpecies(ncbi_genome_summary, genus):
-	list_species = []
+# Index of the NCBI genome summary: for each genus, the species (as lists of words) with
+# the number they have in the summary, already without the phages. Built in one pass
+def buildSpeciesIndex(ncbi_genome_summary):
+	genera = {}
 	with open(ncbi_genome_summary, 'rtU') as reader:
 		blank_line = True
 		for line in reader:
@@ -99,88 +88,655 @@ def retreiveSpecies(ncbi_genome_summary, genus):
 						continue
 					if number > 0:
 						species = species.split(' ')
-						if species[0] == genus:
-							if len(species) >= 3:
-								if species[1] != 'phage' and species[2] != 'phage':
-									list_species.append(species)
-							elif len(species) >= 2:
-								if species[1] != 'phage':
-									list_species.append(species)
-	return list_species
+						if len(species) >= 3:
+							if species[1] != 'phage' and species[2] != 'phage':
+								genera.setdefault(species[0], []).append([species, number])
+						elif len(species) >= 2:
+							if species[1] != 'phage':
+								genera.setdefault(species[0], []).append([species, number])
+	return genera
+
+
+# Load the summary index saved in index_file, building it again (and saving it) when the
+# summary changed since it was built
+def loadSpeciesIndex(ncbi_genome_summary, index_file):
+	summary_stat = os.stat(ncbi_genome_summary)
+	source = [os.path.abspath(ncbi_genome_summary), summary_stat.st_size, summary_stat.st_mtime]
+	if os.path.isfile(index_file):
+		try:
+			with open(index_file, 'rb') as reader:
+				index = pickle.load(reader)
+			if index['source'] == source:
+				return index['genera']
+		except Exception:
+			pass
+	print 'Indexing ' + ncbi_genome_summary
+	genera = buildSpeciesIndex(ncbi_genome_summary)
+	try:
+		with open(index_file + '.part', 'wb') as writer:
+			pickle.dump({'source': source, 'genera': genera}, writer, pickle.HIGHEST_PROTOCOL)
+		os.rename(index_file + '.part', index_file)
+	except (IOError, OSError) as e:
+		print 'It was not possible to save the index ' + index_file + ': ' + str(e)
+	return genera
+
+
+def speciesIndexFile(ncbi_genome_summary):
+	return ncbi_genome_summary + '.species_index.pkl'
+
+
+def retreiveSpecies(ncbi_genome_summary, genus, index_file=None):
+	if index_file is None:
+		index_file = speciesIndexFile(ncbi_genome_summary)
+	genera = loadSpeciesIndex(ncbi_genome_summary, index_file)
+	return [species for species, number in genera.get(genus, [])]
 
 
 def getListGenomesSpecies(species_list, outdir):
 	url = ['http://www.ncbi.nlm.nih.gov/genomes/Genome2BE/genome2srv.cgi?action=download&orgn=', '', '[orgn]&status=50&report=proks&group=--%20All%20Prokaryotes%20--&subgroup=--%20All%20Prokaryotes%20--&format=']
 	url[1] = '%20'.join(species_list)
 	url = ''.join(url)
-	command = ['wget', '-O', os.path.join(outdir, str('_'.join(species_list) + '.NCBI_genomes_proks.completeGenomes.' + time.strftime("%Y%m%d-%H%M%S") + '.tab')), str('"' + url + '"')]
-	run_successfully, stdout, stderr = runCommandPopenCommunicate(command, False, None)
-	variableToPickle = {'_'.join(species_list): run_successfully}
-	saveVariableToPickle(variableToPickle, outdir, str('_'.join(species_list) + '.NCBI_genomes_proks.completeGenomes'))
+	file_name = str('_'.join(species_list) + '.NCBI_genomes_proks.completeGenomes.' + time.strftime("%Y%m%d-%H%M%S") + '.tab')
+	run_successfully = True
+	try:
+		downloadFile(downloader, url, os.path.join(outdir, file_name), None)
+	except IOError as e:
+		print 'It was not possible to download ' + file_name + ': ' + str(e)
+		run_successfully = False
+	return [['_'.join(species_list), run_successfully]]
+
+
+# Lines of a gzip compressed file, decompressed in memory as the file is read
+def readGzipLines(gzip_file):
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	remainder = ''
+	with open(gzip_file, 'rb') as reader:
+		for block in iter(lambda: reader.read(1024 * 1024), ''):
+			data = decompressor.decompress(block)
+			# Concatenated gzip members
+			while len(decompressor.unused_data) > 0:
+				unused_data = decompressor.unused_data
+				decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+				data += decompressor.decompress(unused_data)
+			lines = (remainder + data).split('\n')
+			remainder = lines.pop()
+			for line in lines:
+				yield line + '\n'
+	remainder += decompressor.flush()
+	if len(remainder) > 0:
+		yield remainder
+
+
+def isGzipFile(file_to_test):
+	with open(file_to_test, 'rb') as reader:
+		return reader.read(2) == '\x1f\x8b'
+
+
+def readFastaLines(inputFasta):
+	if isGzipFile(inputFasta):
+		return readGzipLines(inputFasta)
+	return open(inputFasta, 'rtU')
+
+
+# samtools faidx index (and GC content, with count_gc) of a fasta file, built as it is written
+# Not valid if the lines of a sequence do not all have the same length
+def newFastaIndex(count_gc=False):
+	return {'sequences': [], 'short_line': False, 'line_end': None, 'valid': True, 'count_gc': count_gc, 'gc': 0, 'acgt': 0}
+
+
+# offset is the number of bytes of the file before line
+def indexFastaLine(fasta_index, line, offset):
+	if line.startswith('>'):
+		name = line[1:].split(None, 1)
+		fasta_index['sequences'].append([name[0] if len(name) > 0 else '', 0, offset + len(line), 0, 0])
+		fasta_index['short_line'] = False
+		return
+	if len(fasta_index['sequences']) == 0:
+		fasta_index['valid'] = False
+		return
+	sequence = fasta_index['sequences'][-1]
+	# Most lines are full lines of the sequence
+	if len(line) == sequence[4] and not fasta_index['short_line'] and line.endswith(fasta_index['line_end']) and len(fasta_index['line_end']) == sequence[4] - sequence[3]:
+		sequence[1] += sequence[3]
+		if fasta_index['count_gc']:
+			countFastaGC(fasta_index, line[:sequence[3]])
+		return
+	bases = line.rstrip('\r\n')
+	number_bases = len(bases)
+	if sequence[4] == 0:
+		sequence[3] = number_bases
+		sequence[4] = len(line)
+		fasta_index['line_end'] = line[number_bases:]
+	elif number_bases > 0 and (fasta_index['short_line'] or number_bases > sequence[3] or (line.endswith('\n') and len(line) != sequence[4] - sequence[3] + number_bases)):
+		fasta_index['valid'] = False
+	if number_bases < sequence[3] or number_bases == 0:
+		fasta_index['short_line'] = True
+	sequence[1] += number_bases
+	if fasta_index['count_gc']:
+		countFastaGC(fasta_index, bases)
+
+
+def countFastaGC(fasta_index, bases):
+	bases = bases.upper()
+	gc = bases.count('G') + bases.count('C')
+	fasta_index['gc'] += gc
+	fasta_index['acgt'] += gc + bases.count('A') + bases.count('T')
+
+
+def writeFastaIndex(fasta_index, fai_file):
+	with open(fai_file, 'wt') as writer:
+		for sequence in fasta_index['sequences']:
+			writer.write('\t'.join(map(str, sequence)) + '\n')
+
+
+# Number of sequences, total length, N50 and GC content (over the A, C, G and T bases)
+def writeGenomeSummary(fasta_index, fasta, summary_file):
+	lengths = sorted([sequence[1] for sequence in fasta_index['sequences']], reverse=True)
+	total_length = sum(lengths)
+	n50 = 0
+	cumulative_length = 0
+	for length in lengths:
+		cumulative_length += length
+		if 2 * cumulative_length >= total_length:
+			n50 = length
+			break
+	gc_percent = round(100.0 * fasta_index['gc'] / fasta_index['acgt'], 2) if fasta_index['acgt'] > 0 else 'NA'
+	with open(summary_file, 'wt') as writer:
+		writer.write('\t'.join(['#genome', 'number_sequences', 'total_length', 'N50', 'GC_percent']) + '\n')
+		writer.write('\t'.join(map(str, [os.path.basename(fasta), len(lengths), total_length, n50, gc_percent])) + '\n')
+
+
+# Files written with the renamed genome (no .fai for gzip output, a marker when not indexable)
+def renamedFastaIndexFile(outputFasta):
+	return outputFasta + '.fai' if not outputFasta.endswith('.gz') else None
+
+
+def renamedFastaUnindexableFile(outputFasta):
+	return outputFasta + '.fai.unindexable'
+
+
+def renamedFastaSummaryFile(outputFasta):
+	return (outputFasta[:-len('.gz')] if outputFasta.endswith('.gz') else outputFasta) + '.summary.tab'
+
+
+# Whether the renamed genome or some of the files written with it are missing
+def renamedFilesMissing(renamed_fasta, genome_summary):
+	renamed_files = [[renamed_fasta]]
+	if renamedFastaIndexFile(renamed_fasta) is not None:
+		renamed_files.append([renamedFastaIndexFile(renamed_fasta), renamedFastaUnindexableFile(renamed_fasta)])
+	if genome_summary:
+		renamed_files.append([renamedFastaSummaryFile(renamed_fasta)])
+	return not all(any(map(os.path.isfile, files)) for files in renamed_files)
 
 
 # Rename sequences
-def renameSequences(inputFasta, outputFasta):
-	with open(outputFasta, 'wt') as writer:
-		with open(inputFasta, 'rtU') as reader:
-			for line in reader:
-				if len(line) > 0:
-					if line.startswith('>'):
-						accession = line[1:].split(' ')[0]
-						gi = convert_accession_2_gi(accession)
-						line = '>' + str('gi|' + gi + '|') + ' ' + line[1:]
-						writer.write(line)
-					else:
-						writer.write(line)
-
-
-def convert_accession_2_gi(accession_number):
-	url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&id=' + accession_number + '&rettype=gi'
-	gi = urllib.urlopen(url).read().splitlines()[0]
-	if len(gi) == 0:
-		gi = None
-	return gi
+# The output is only put in place when complete, with its .fai index and, with
+# genome_summary, its summary. cache_settings is None or [cache_file, ttl_days, max_entries, offline]
+def renameSequences(inputFasta, outputFasta, cache_settings=None, genome_summary=False):
+	cache = lookupcache.open_cache(*cache_settings) if cache_settings is not None else None
+	part_file = outputFasta + '.part'
+	fai_file = renamedFastaIndexFile(outputFasta)
+	try:
+		# Includes the eutils stages of the accessions not cached
+		with instrumentation.timedStage('rename_sequences') as stage:
+			accessions = [line[1:].rstrip('\r\n').split(' ')[0] for line in readFastaLines(inputFasta) if line.startswith('>')]
+			gis = convert_accessions_2_gi(accessions, cache)
+
+			fasta_index = newFastaIndex(genome_summary)
+			offset = 0
+			writer = gzip.GzipFile(part_file, 'wb', 6) if outputFasta.endswith('.gz') else open(part_file, 'wt')
+			with writer:
+				for line in readFastaLines(inputFasta):
+					if len(line) > 0:
+						if line.startswith('>'):
+							accession = line[1:].rstrip('\r\n').split(' ')[0]
+							gi = gis.get(accession)
+							if gi is not None:
+								line = '>' + str('gi|' + gi + '|') + ' ' + line[1:]
+							writer.write(line)
+						else:
+							writer.write(line)
+						indexFastaLine(fasta_index, line, offset)
+						offset += len(line)
+			if fai_file is not None and fasta_index['valid']:
+				writeFastaIndex(fasta_index, fai_file + '.part')
+			if genome_summary:
+				writeGenomeSummary(fasta_index, outputFasta, renamedFastaSummaryFile(outputFasta))
+			stage['bytes'] += os.path.getsize(inputFasta)
+			stage['records'] += len(accessions)
+		os.rename(part_file, outputFasta)
+		if fai_file is not None:
+			unindexable_file = renamedFastaUnindexableFile(outputFasta)
+			if fasta_index['valid']:
+				os.rename(fai_file + '.part', fai_file)
+				if os.path.isfile(unindexable_file):
+					os.remove(unindexable_file)
+			else:
+				print 'It was not possible to index ' + outputFasta + ': the lines of some sequences do not have the same length'
+				if os.path.isfile(fai_file):
+					os.remove(fai_file)
+				with open(unindexable_file, 'wt') as writer:
+					writer.write('The lines of some sequences do not have the same length\n')
+	finally:
+		if cache is not None:
+			lookupcache.close_cache(cache)
+
+
+def convert_accession_2_gi(accession_number, cache=None):
+	return convert_accessions_2_gi([accession_number], cache).get(accession_number)
+
+
+def waitEutils(downloader):
+	now = time.time()
+	if downloader['eutils_next_request'] > now:
+		with instrumentation.timedStage('eutils_wait'):
+			time.sleep(downloader['eutils_next_request'] - now)
+	downloader['eutils_next_request'] = max(now, downloader['eutils_next_request']) + downloader['eutils_interval']
+
+
+# Resolve a batch of nuccore accessions with a single esummary request. Returns a dict
+# with the GI of each accession found (both with and without version)
+def esummary_accessions_gi(accessions):
+	form_data = {'db': 'nuccore', 'id': ','.join(accessions), 'retmode': 'json'}
+	if downloader['api_key'] is not None:
+		form_data['api_key'] = downloader['api_key']
+	waitEutils(downloader)
+	with instrumentation.timedStage('eutils') as stage:
+		result = json.loads(fetchUrlContent(downloader, eutils_url + 'esummary.fcgi', form_data)).get('result', {})
+		stage['records'] += len(accessions)
+	gis = {}
+	for uid in result.get('uids', []):
+		document = result.get(uid, {})
+		for accession in (document.get('accessionversion'), document.get('caption')):
+			if accession is not None:
+				gis[str(accession)] = str(uid)
+	return gis
+
+
+# Get the GI of many accessions, from the cache or else from NCBI in batches (the number
+# of requests depends on the number of batches, not of accessions). Returns a dict with
+# the GI of the accessions found
+def convert_accessions_2_gi(accessions, cache=None):
+	if downloader is None:
+		initDownloader(3, 300)
+	gis = {}
+	accessions_to_fetch = []
+	for accession in accessions:
+		if accession in gis or accession in accessions_to_fetch:
+			continue
+		gi = lookupcache.cache_get(cache, 'nuccore_gi', accession) if cache is not None else None
+		if gi is not None:
+			gis[accession] = gi
+		else:
+			accessions_to_fetch.append(accession)
+	if cache is not None:
+		lookupcache.commit_cache(cache)
+		if cache['offline']:
+			return gis
+
+	for i in range(0, len(accessions_to_fetch), eutils_batch_size):
+		batch = accessions_to_fetch[i:i + eutils_batch_size]
+		batch_gis = esummary_accessions_gi(batch)
+		batch_values = []
+		for accession in batch:
+			gi = batch_gis.get(accession)
+			if gi is None:
+				gi = batch_gis.get(accession.split('.')[0])
+			if gi is not None:
+				gis[accession] = gi
+				batch_values.append([accession, gi])
+		if cache is not None:
+			lookupcache.cache_put(cache, 'nuccore_gi', batch_values)
+	return gis
+
+
+# eutils_interval is the minimum time between E-utilities requests of the process (NCBI
+# allows 3 requests per second, or 10 with an API key, for all the processes together).
+# The file transfers are reported to progress_queue (see startProgress), if given
+def initDownloader(retries, timeout, eutils_interval=1.0 / 3, api_key=None, progress_queue=None):
+	global downloader
+	downloader = {'connections': {}, 'retries': retries, 'timeout': timeout, 'eutils_interval': eutils_interval, 'eutils_next_request': 0.0, 'api_key': api_key, 'progress_queue': progress_queue}
+
+
+# Events: ('start', file, offset, size), ('bytes', file, n), ('retry', file),
+# ('done', file, 'downloaded' or 'skipped') and ('failed', file)
+def reportTransfer(downloader, *event):
+	if downloader.get('progress_queue') is not None:
+		downloader['progress_queue'].put(event)
+
+
+def getConnection(downloader, scheme, host):
+	if (scheme, host) not in downloader['connections']:
+		if scheme == 'https':
+			downloader['connections'][(scheme, host)] = httplib.HTTPSConnection(host, timeout=downloader['timeout'])
+		else:
+			downloader['connections'][(scheme, host)] = httplib.HTTPConnection(host, timeout=downloader['timeout'])
+	return downloader['connections'][(scheme, host)]
+
+
+def dropConnection(downloader, scheme, host):
+	connection = downloader['connections'].pop((scheme, host), None)
+	if connection is not None:
+		connection.close()
+
+
+# NCBI serves the same paths over https, which allows keep-alive connections and ranges
+def ftpToHttps(url):
+	if url.startswith('ftp://'):
+		url = 'https://' + url[len('ftp://'):]
+	return url
+
+
+# Make a request over the worker keep-alive connections, following redirections. The
+# caller must read the whole response (or drop the connection) before the next request
+def requestUrl(downloader, method, url, headers, body=None):
+	for redirection in range(0, 6):
+		url_parts = urlparse.urlsplit(url)
+		path = url_parts.path + ('?' + url_parts.query if len(url_parts.query) > 0 else '')
+		connection = getConnection(downloader, url_parts.scheme, url_parts.netloc)
+		try:
+			connection.request(method, path, body=body, headers=headers)
+			response = connection.getresponse()
+		except:
+			dropConnection(downloader, url_parts.scheme, url_parts.netloc)
+			raise
+		if response.status in (301, 302, 303, 307, 308) and response.getheader('location') is not None:
+			response.read()
+			url = urlparse.urljoin(url, response.getheader('location'))
+			continue
+		return response, url_parts
+	raise IOError('Too many redirections for ' + url)
+
+
+def retryWait(attempt):
+	time.sleep((2 ** attempt) * (0.5 + random.random()))
+
+
+# Get the content of url, or post form_data to it
+def fetchUrlContent(downloader, url, form_data=None):
+	for attempt in range(0, downloader['retries'] + 1):
+		url_parts = None
+		try:
+			with instrumentation.timedStage('fetch') as stage:
+				if form_data is None:
+					response, url_parts = requestUrl(downloader, 'GET', url, {})
+				else:
+					response, url_parts = requestUrl(downloader, 'POST', url, {'Content-Type': 'application/x-www-form-urlencoded'}, urllib.urlencode(form_data))
+				content = response.read()
+				stage['bytes'] += len(content)
+		except (httplib.HTTPException, socket.error) as e:
+			if url_parts is not None:
+				dropConnection(downloader, url_parts.scheme, url_parts.netloc)
+			error = str(e)
+		else:
+			if response.status == 200:
+				return content
+			error = 'HTTP ' + str(response.status) + ' ' + response.reason
+			if response.status < 500 and response.status != 429:
+				break
+		if attempt < downloader['retries']:
+			retryWait(attempt)
+	raise IOError(error + ' for ' + url)
+
+
+def md5File(file_path):
+	md5 = hashlib.md5()
+	with instrumentation.timedStage('md5') as stage:
+		with open(file_path, 'rb') as reader:
+			for block in iter(lambda: reader.read(1024 * 1024), ''):
+				md5.update(block)
+				stage['bytes'] += len(block)
+	return md5.hexdigest()
+
+
+# Download url to destination, resuming an interrupted download
+# Returns 'skipped' when destination is already there with the expected md5 (or size)
+def downloadFile(downloader, url, destination, expected_md5):
+	file_name = os.path.basename(destination)
+	if os.path.isfile(destination):
+		if expected_md5 is not None:
+			if md5File(destination) == expected_md5:
+				reportTransfer(downloader, 'done', file_name, 'skipped')
+				return 'skipped'
+		else:
+			try:
+				response, url_parts = requestUrl(downloader, 'HEAD', url, {})
+				response.read()
+			except (httplib.HTTPException, socket.error):
+				pass
+			else:
+				if response.status == 200 and response.getheader('content-length') == str(os.path.getsize(destination)):
+					reportTransfer(downloader, 'done', file_name, 'skipped')
+					return 'skipped'
+
+	part_file = destination + '.part'
+	error = None
+	for attempt in range(0, downloader['retries'] + 1):
+		offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+		headers = {'Range': 'bytes=' + str(offset) + '-'} if offset > 0 else {}
+		url_parts = None
+		try:
+			response, url_parts = requestUrl(downloader, 'GET', url, headers)
+			if response.status == 416:
+				# The part file already has the whole content
+				response.read()
+			elif response.status in (200, 206):
+				if response.status == 200:
+					offset = 0
+				size = response.getheader('content-length')
+				size = offset + int(size) if size is not None and size.isdigit() else None
+				reportTransfer(downloader, 'start', file_name, offset, size)
+				# Streamed to disk a block at a time, never holding the whole file in memory
+				with instrumentation.timedStage('download') as stage, open(part_file, 'ab' if response.status == 206 else 'wb') as writer:
+					for block in iter(lambda: response.read(1024 * 1024), ''):
+						writer.write(block)
+						reportTransfer(downloader, 'bytes', file_name, len(block))
+						stage['bytes'] += len(block)
+				# httplib ends the response without error when the connection is closed early
+				if size is not None and os.path.getsize(part_file) < size:
+					raise httplib.IncompleteRead(str(os.path.getsize(part_file) - offset) + ' bytes read, ' + str(size - os.path.getsize(part_file)) + ' more expected')
+			else:
+				response.read()
+				error = 'HTTP ' + str(response.status) + ' ' + response.reason
+				if response.status < 500 and response.status != 429:
+					break
+				if attempt < downloader['retries']:
+					reportTransfer(downloader, 'retry', file_name)
+					retryWait(attempt)
+				continue
+		except (httplib.HTTPException, socket.error) as e:
+			if url_parts is not None:
+				dropConnection(downloader, url_parts.scheme, url_parts.netloc)
+			error = str(e)
+			if attempt < downloader['retries']:
+				reportTransfer(downloader, 'retry', file_name)
+				retryWait(attempt)
+			continue
+
+		if expected_md5 is not None and md5File(part_file) != expected_md5:
+			os.remove(part_file)
+			error = 'md5 checksum does not match'
+			if attempt < downloader['retries']:
+				reportTransfer(downloader, 'retry', file_name)
+			continue
+		os.rename(part_file, destination)
+		instrumentation.stageCounters('download')['records'] += 1
+		reportTransfer(downloader, 'done', file_name, 'downloaded')
+		return 'downloaded'
+	reportTransfer(downloader, 'failed', file_name)
+	raise IOError(error + ' for ' + url)
+
+
+# md5 checksums of the assembly files, from the md5checksums.txt of the assembly folder
+def getAssemblyMd5(downloader, assembly_url):
+	md5_checksums = {}
+	try:
+		content = fetchUrlContent(downloader, assembly_url + '/md5checksums.txt')
+	except IOError as e:
+		print 'It was not possible to get the md5 checksums of ' + assembly_url + ': ' + str(e)
+	else:
+		for line in content.splitlines():
+			line = line.split()
+			if len(line) == 2:
+				md5_checksums[os.path.basename(line[1])] = line[0]
+	return md5_checksums
 
 
-def getGenomes(file_list_complete_genomes, outdir):
+def readAssembliesFtp(file_list_complete_genomes):
+	assemblies_ftp = []
 	with open(file_list_complete_genomes, 'rtU') as reader:
 		for line in reader:
 			line = line.splitlines()[0]
 			if len(line) > 0:
 				if not line.startswith('#'):
 					line = line.split('\t')
-					ftp = line[19]
-					sample = ftp.rsplit('/', 1)[1]
-
-					url = ftp + '/' + sample + '_genomic.fna.gz'
-					command = ['wget', '-O', os.path.join(outdir, str(sample + '_genomic.fna.gz')), str('"' + url + '"')]
-					run_successfully, stdout, stderr = runCommandPopenCommunicate(command, False, None)
-					variableToPickle = {sample: run_successfully}
-					saveVariableToPickle(variableToPickle, outdir, str(sample + '.fna'))
-					if run_successfully:
-						command_gz = ['gunzip', '--keep', os.path.join(outdir, str(sample + '_genomic.fna.gz'))]
-						run_successfully, stdout, stderr = runCommandPopenCommunicate(command_gz, False, None)
-						if run_successfully:
-							renameSequences(os.path.join(outdir, str(sample + '_genomic.fna')), os.path.join(outdir, str(sample + '_genomic.fna.renamed.fasta')))
-
-					command[2] = os.path.join(outdir, str(sample + '_genomic.gbff.gz'))
-					url = ftp + '/' + sample + '_genomic.gbff.gz'
-					command[3] = '"' + url + '"'
-					run_successfully, stdout, stderr = runCommandPopenCommunicate(command, False, None)
-					variableToPickle = {sample: run_successfully}
-					saveVariableToPickle(variableToPickle, outdir, str(sample + '.gbff'))
-
-
-def saveVariableToPickle(variableToStore, outdir, prefix):
-	pickleFile = os.path.join(outdir, str(prefix + '.pkl'))
-	with open(pickleFile, 'wb') as writer:
-		pickle.dump(variableToStore, writer)
-
-
-def extractVariableFromPickle(pickleFile):
-	with open(pickleFile, 'rb') as reader:
-		variable = pickle.load(reader)
-	return variable
+					assemblies_ftp.append(line[19])
+	return assemblies_ftp
+
+
+# Download the genome sequence (then decompressed and renamed) and the GenBank file of
+# one assembly, skipping what was already downloaded
+def getGenome(ftp, outdir, cache_settings, gzip_renamed, genome_summary=False):
+	downloads_run_successfully = []
+	sample = ftp.rstrip('/').rsplit('/', 1)[1]
+	assembly_url = ftpToHttps(ftp.rstrip('/'))
+	md5_checksums = getAssemblyMd5(downloader, assembly_url)
+
+	for extension in ('_genomic.fna.gz', '_genomic.gbff.gz'):
+		file_name = sample + extension
+		try:
+			download_status = downloadFile(downloader, assembly_url + '/' + file_name, os.path.join(outdir, file_name), md5_checksums.get(file_name))
+		except IOError as e:
+			print 'It was not possible to download ' + file_name + ': ' + str(e)
+			downloads_run_successfully.append([sample, False])
+			continue
+		print file_name + ' ' + download_status
+		downloads_run_successfully.append([sample, True])
+
+		# The headers are renamed while decompressing, without writing the decompressed genome
+		renamed_fasta = os.path.join(outdir, str(sample + '_genomic.fna.renamed.fasta' + ('.gz' if gzip_renamed else '')))
+		if extension == '_genomic.fna.gz' and (download_status == 'downloaded' or renamedFilesMissing(renamed_fasta, genome_summary)):
+			try:
+				renameSequences(os.path.join(outdir, file_name), renamed_fasta, cache_settings, genome_summary)
+			except (IOError, zlib.error, sqlite3.Error) as e:
+				print 'It was not possible to rename the sequences of ' + file_name + ': ' + str(e)
+				downloads_run_successfully[-1][1] = False
+	return downloads_run_successfully
+
+
+# Live metrics of the file transfers of the pool workers, which send their events (see
+# reportTransfer) through a queue. A thread keeps the per-file and aggregate counts, shows
+# them in a progress line (stderr) every interval seconds and writes them to metrics_file
+def startProgress(metrics_file, total_files, interval):
+	progress = {'queue': multiprocessing.Queue(), 'metrics_file': metrics_file, 'interval': interval, 'start_time': time.time(), 'total_files': total_files, 'files': {}, 'bytes': 0, 'downloaded': 0, 'skipped': 0, 'retries': 0, 'failures': 0}
+	progress['thread'] = threading.Thread(target=monitorProgress, args=(progress,))
+	progress['thread'].daemon = True
+	progress['thread'].start()
+	return progress
+
+
+def stopProgress(progress):
+	progress['queue'].put(None)
+	progress['thread'].join()
+
+
+def updateProgress(progress, event):
+	now = time.time()
+	file_metrics = progress['files'].setdefault(event[1], {'status': 'running', 'bytes': 0, 'size': None, 'retries': 0, 'start_time': now, 'end_time': None})
+	if event[0] == 'start':
+		file_metrics['status'] = 'running'
+		file_metrics['size'] = event[3]
+		file_metrics['resumed_from'] = event[2]
+	elif event[0] == 'bytes':
+		file_metrics['bytes'] += event[2]
+		progress['bytes'] += event[2]
+	elif event[0] == 'retry':
+		file_metrics['retries'] += 1
+		progress['retries'] += 1
+	elif event[0] == 'done':
+		file_metrics['status'] = event[2]
+		file_metrics['end_time'] = now
+		progress[event[2]] += 1
+	elif event[0] == 'failed':
+		file_metrics['status'] = 'failed'
+		file_metrics['end_time'] = now
+		progress['failures'] += 1
+
+
+def progressMetrics(progress):
+	now = time.time()
+	elapsed = max(now - progress['start_time'], 1e-6)
+	finished = progress['downloaded'] + progress['skipped'] + progress['failures']
+	metrics = {'elapsed_seconds': round(elapsed, 3), 'bytes': progress['bytes'], 'bytes_per_second': round(progress['bytes'] / elapsed, 1), 'total_files': progress['total_files'], 'files_downloaded': progress['downloaded'], 'files_skipped': progress['skipped'], 'files_per_second': round(finished / elapsed, 4), 'retries': progress['retries'], 'failures': progress['failures'], 'eta_seconds': None, 'files': {}}
+	if finished > 0 and progress['total_files'] is not None:
+		metrics['eta_seconds'] = round(max(progress['total_files'] - finished, 0) / (finished / elapsed), 1)
+	for file_name, file_metrics in progress['files'].items():
+		file_elapsed = max((file_metrics['end_time'] or now) - file_metrics['start_time'], 1e-6)
+		metrics['files'][file_name] = {'status': file_metrics['status'], 'bytes': file_metrics['bytes'], 'size': file_metrics['size'], 'retries': file_metrics['retries'], 'seconds': round(file_elapsed, 3), 'bytes_per_second': round(file_metrics['bytes'] / file_elapsed, 1)}
+	return metrics
+
+
+def humanBytes(number_bytes):
+	for unit in ('B', 'KB', 'MB', 'GB'):
+		if number_bytes < 1024:
+			break
+		number_bytes /= 1024.0
+	return str(round(number_bytes, 1)) + ' ' + unit
+
+
+def writeProgress(progress, final):
+	metrics = progressMetrics(progress)
+	with open(progress['metrics_file'] + '.part', 'wt') as writer:
+		json.dump(metrics, writer, indent=1, sort_keys=True)
+	os.rename(progress['metrics_file'] + '.part', progress['metrics_file'])
+
+	line = str(metrics['files_downloaded'] + metrics['files_skipped']) + '/' + str(metrics['total_files']) + ' files, ' + humanBytes(metrics['bytes']) + ' at ' + humanBytes(metrics['bytes_per_second']) + '/s, ' + str(metrics['files_per_second']) + ' files/s, ' + str(metrics['retries']) + ' retries, ' + str(metrics['failures']) + ' failures'
+	if metrics['eta_seconds'] is not None and not final:
+		line += ', ETA ' + str(int(metrics['eta_seconds'])) + 's'
+	# On a terminal the progress line is rewritten in place
+	if sys.stderr.isatty():
+		sys.stderr.write('\r' + line.ljust(100) + ('\n' if final else ''))
+	else:
+		sys.stderr.write(line + '\n')
+	sys.stderr.flush()
+
+
+def monitorProgress(progress):
+	last_report = time.time()
+	while True:
+		try:
+			event = progress['queue'].get(timeout=0.5)
+		except Queue.Empty:
+			event = False
+		if event is None:
+			break
+		if event:
+			updateProgress(progress, event)
+		if time.time() - last_report >= progress['interval']:
+			writeProgress(progress, False)
+			last_report = time.time()
+	writeProgress(progress, True)
+
+
+# Run the tasks in a pool and write the names of the failed downloads to bad_file as
+# the tasks finish. A task that raised is reported with the name given by task_name.
+# The workers downloader is set up with the transfer metrics going to metrics_file
+def runDownloadTasks(tasks, threads, bad_file, task_name, downloader_args, metrics_file, total_files, progress_interval):
+	progress = startProgress(metrics_file, total_files, progress_interval)
+	with open(bad_file, 'wt') as writer:
+		pool = multiprocessing.Pool(processes=threads, initializer=initDownloader, initargs=tuple(downloader_args) + (progress['queue'],))
+		for task, downloads_run_successfully, error, task_instrumentation in pool.imap_unordered(instrumentation.runPoolTask, tasks):
+			instrumentation.mergeInstrumentation(task_instrumentation)
+			if error is not None:
+				print 'It was not possible to run ' + task[0].__name__ + ' for ' + task_name(task) + '\n' + error
+				downloads_run_successfully = [[task_name(task), False]]
+			for download, run_successfully in downloads_run_successfully:
+				if not run_successfully:
+					writer.write(download + '\n')
+					writer.flush()
+		pool.close()
+		pool.join()
+	stopProgress(progress)
 
 
 def runTime(start_time):
@@ -197,34 +753,59 @@ def runGetCompleteGenomes(args):
 
 	threads = args.threads[0]
 	input_ncbi_genome_summary = os.path.abspath(args.input_ncbi_genome_summary[0].name)
-	genus = args.genus[0]
+	genera = []
+	if args.genus is not None:
+		genera.extend(args.genus)
+	if args.genusList is not None:
+		with open(args.genusList[0].name, 'rtU') as reader:
+			for line in reader:
+				line = line.strip()
+				if len(line) > 0 and not line.startswith('#'):
+					genera.append(line)
 	outdir = os.path.abspath(args.outdir[0])
 	check_create_directory(outdir)
 
-	list_species_inListFormat = retreiveSpecies(input_ncbi_genome_summary, genus)
+	cache_settings = None
+	if args.cacheFile is not None:
+		cache_settings = [os.path.abspath(args.cacheFile[0]), args.cacheTTL[0], args.cacheMaxEntries[0], args.offline]
+
+	index_file = os.path.abspath(args.summaryIndex[0]) if args.summaryIndex is not None else speciesIndexFile(input_ncbi_genome_summary)
+	with instrumentation.timedStage('species_index') as stage:
+		species_index = loadSpeciesIndex(input_ncbi_genome_summary, index_file)
+		stage['bytes'] += os.path.getsize(input_ncbi_genome_summary)
+		stage['records'] += len(species_index)
+	list_species_inListFormat = []
+	for genus in genera:
+		genus_species = [species for species, number in species_index.get(genus, [])]
+		print genus + ': ' + str(len(genus_species)) + ' species'
+		for species in genus_species:
+			if species not in list_species_inListFormat:
+				list_species_inListFormat.append(species)
 
 	folder_files_list_genomes = os.path.join(outdir, 'complete_genomes_files_list', '')
+	check_create_directory(folder_files_list_genomes)
+	downloader_args = [args.retries[0], args.timeout[0], threads / (10.0 if args.ncbiApiKey is not None else 3.0), args.ncbiApiKey]
+	tasks = [(getListGenomesSpecies, (species_list, folder_files_list_genomes,)) for species_list in list_species_inListFormat]
+	runDownloadTasks(tasks, threads, os.path.join(outdir, 'bad.complete_genomes_files_list.txt'), lambda task: '_'.join(task[1][0]), downloader_args, os.path.join(outdir, 'download_metrics.complete_genomes_files_list.json'), len(tasks), args.progressInterval[0])
 
-	pool = multiprocessing.Pool(processes=threads)
 	folder_genomes = os.path.join(outdir, 'complete_genomes_files', '')
 	check_create_directory(folder_genomes)
 	files = [f for f in os.listdir(folder_files_list_genomes) if not f.startswith('.') and os.path.isfile(os.path.join(folder_files_list_genomes, f))]
+	# The work is spread by assembly, not by list file
+	assemblies_ftp = []
 	for file_found in files:
-		file_found = os.path.join(folder_files_list_genomes, file_found)
-		pool.apply_async(getGenomes, args=(file_found, folder_genomes,))
-	pool.close()
-	pool.join()
-	files = [f for f in os.listdir(folder_genomes) if not f.startswith('.') and os.path.isfile(os.path.join(folder_genomes, f))]
-	with open(os.path.join(outdir, 'bad.complete_genomes_files.txt'), 'wt') as writer:
-		for file_found in files:
-			if file_found.endswith('.pkl'):
-				file_found = os.path.join(folder_genomes, file_found)
-				file_run_successfully = extractVariableFromPickle(file_found)
-				for i in file_run_successfully:
-					if not file_run_successfully[i]:
-						writer.write(i + '\n')
-						writer.flush()
-				os.remove(file_found)
+		for ftp in readAssembliesFtp(os.path.join(folder_files_list_genomes, file_found)):
+			if ftp not in assemblies_ftp:
+				assemblies_ftp.append(ftp)
+	tasks = [(getGenome, (ftp, folder_genomes, cache_settings, args.gzipRenamed, args.genomeSummary,)) for ftp in assemblies_ftp]
+	# Two files (sequences and GenBank) for each assembly
+	runDownloadTasks(tasks, threads, os.path.join(outdir, 'bad.complete_genomes_files.txt'), lambda task: task[1][0].rstrip('/').rsplit('/', 1)[-1], downloader_args, os.path.join(outdir, 'download_metrics.complete_genomes_files.json'), 2 * len(tasks), args.progressInterval[0])
+
+	# Once all the workers are done with the cache
+	if cache_settings is not None:
+		cache = lookupcache.open_cache(*cache_settings)
+		lookupcache.evict_cache(cache)
+		lookupcache.close_cache(cache)
 
 	print ''
 	runTime(general_start_time)
@@ -241,17 +822,39 @@ def main():
 
 	parser_required = parser.add_argument_group('Required options')
 	parser_required.add_argument('-i', '--input_ncbi_genome_summary', nargs=1, type=argparse.FileType('r'), metavar='/path/to/file/with/ncbi/genome/summary.txt', help='Path to text file containing the NCBI genome summary from a genus', required=True)
-	parser_required.add_argument('-g', '--genus', nargs=1, type=str, metavar='Streptococcus', help='The genus name to look for', required=True)
+	parser_required.add_argument('-g', '--genus', nargs='+', type=str, metavar='Streptococcus', help='The genus name (or names, separated by space) to look for (required if --genusList is not given)', required=False)
+	parser_required.add_argument('--genusList', nargs=1, type=argparse.FileType('r'), metavar='/path/to/file/with/genus/list.txt', help='Path to file containing a list (one per line) of genus names to look for (required if --genus is not given)', required=False)
 	parser_optional = parser.add_argument_group('Facultative options')
 	parser_optional.add_argument('-o', '--outdir', nargs=1, type=str, metavar='/path/to/output/directory/', help='Path to where to store the outputs', required=False, default=['.'])
-	parser_optional.add_argument('-j', '--threads', nargs=1, metavar=('N'), type=int, help='Number of threads to be used', required=False, default=[1])
+	parser_optional.add_argument('--summaryIndex', nargs=1, type=str, metavar='/path/to/summary.species_index.pkl', help='Path to the index of the NCBI genome summary, built once and rebuilt only when the summary changes (by default, the summary path with .species_index.pkl)', required=False)
+	parser_optional.add_argument('-j', '--threads', nargs=1, metavar=('N'), type=int, help='Number of threads to be used (also the number of assemblies downloaded at the same time)', required=False, default=[1])
+	parser_optional.add_argument('--gzipRenamed', action='store_true', help='Write the genomes with renamed sequences gzip compressed (_genomic.fna.renamed.fasta.gz). Without it, the samtools faidx index of each genome is written with it (_genomic.fna.renamed.fasta.fai, or the _genomic.fna.renamed.fasta.fai.unindexable marker for genomes whose sequence lines do not all have the same length)')
+	parser_optional.add_argument('--genomeSummary', action='store_true', help='Also write, while the sequences are renamed, a summary of each genome with its number of sequences, total length, N50 and GC content (_genomic.fna.renamed.fasta.summary.tab)')
+	parser_optional.add_argument('--ncbiApiKey', type=str, metavar='API_KEY', help='NCBI API key, allows more E-utilities requests per second for the accession to GI conversions', required=False)
+	parser_optional.add_argument('--retries', nargs=1, metavar=('N'), type=int, help='Number of times an interrupted or failed download is retried (resuming from what was already downloaded)', required=False, default=[5])
+	parser_optional.add_argument('--timeout', nargs=1, metavar=('N'), type=float, help='Timeout in seconds for the download connections', required=False, default=[300])
+	parser_optional.add_argument('--profile', action='store_true', help='Profile the run with cProfile (all processes together in getCompleteGenomes.profile.pstats and the top functions in getCompleteGenomes.profile.txt, in outdir)')
+	parser_optional.add_argument('--progressInterval', nargs=1, metavar=('N'), type=float, help='Seconds between updates of the download progress line and of the download_metrics JSON files (bytes/s, files/s, retries, failures, ETA, per-file metrics)', required=False, default=[5])
+
+	parser_cache = parser.add_argument_group('Cache options')
+	parser_cache.add_argument('--cacheFile', nargs=1, type=str, metavar='/path/to/accessions_cache.sqlite', help='SQLite file used to cache the accession to GI conversions between runs (created if it does not exist)', required=False)
+	parser_cache.add_argument('--cacheTTL', nargs=1, metavar=('DAYS'), type=float, help='Number of days after which cached conversions are retrieved again (0 keeps them forever)', required=False, default=[30])
+	parser_cache.add_argument('--cacheMaxEntries', nargs=1, metavar=('N'), type=int, help='Maximum number of entries kept in the cache, the least recently used are removed first (0 for no limit)', required=False, default=[1000000])
+	parser_cache.add_argument('--offline', action='store_true', help='Do not connect to NCBI for the accession to GI conversions, use only the cached ones (requires --cacheFile)')
 
 	parser.set_defaults(func=runGetCompleteGenomes)
 
 	args = parser.parse_args()
 
-	args.func(args)
+	if args.offline and args.cacheFile is None:
+		parser.error('--offline requires --cacheFile')
+	if args.genus is None and args.genusList is None:
+		parser.error('one of --genus or --genusList is required')
 
+	# Timings of each stage go to getCompleteGenomes.instrumentation.json in outdir
+	outdir = os.path.abspath(args.outdir[0])
+	check_create_directory(outdir)
+	instrumentation.runInstrumented(args.func, (args,), outdir, 'getCompleteGenomes.py', version, args.profile)
 
 
 if __name__ == "__main__":
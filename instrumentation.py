@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+instrumentation.py - Per-stage timings and profiling shared by the scripts
+<https://github.com/miguelpmachado/pythonScripts>
+
+Copyright (C) 2026 Miguel Machado <mpmachado@medicina.ulisboa.pt>
+
+Last modified: October 18, 2026
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import json
+import resource
+import threading
+import traceback
+import multiprocessing
+import contextlib
+import cProfile
+import pstats
+import tempfile
+import shutil
+
+
+# Stages of each worker (process and thread) and, with --profile, where the profiles go
+state = {'workers': {}, 'profile_directory': None}
+
+# CPU time of the calling thread only (RUSAGE_THREAD, Linux). Elsewhere the stages have
+# no CPU time
+rusage_thread = getattr(resource, 'RUSAGE_THREAD', 1 if sys.platform.startswith('linux') else None)
+
+counters_names = ['calls', 'wall_seconds', 'cpu_seconds', 'bytes', 'records']
+
+
+def workerName():
+	return multiprocessing.current_process().name + '/' + threading.current_thread().name
+
+
+def threadCpuTime():
+	if rusage_thread is None:
+		return None
+	usage = resource.getrusage(rusage_thread)
+	return usage.ru_utime + usage.ru_stime
+
+
+def newCounters():
+	return {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0 if rusage_thread is not None else None, 'bytes': 0, 'records': 0}
+
+
+def addCounters(counters, other_counters):
+	for counter in counters_names:
+		if counters[counter] is not None and other_counters[counter] is not None:
+			counters[counter] += other_counters[counter]
+		else:
+			counters[counter] = None
+
+
+def stageCounters(stage):
+	return state['workers'].setdefault(workerName(), {}).setdefault(stage, newCounters())
+
+
+@contextlib.contextmanager
+def timedStage(stage):
+	counters = stageCounters(stage)
+	start_time = time.time()
+	start_cpu = threadCpuTime()
+	try:
+		yield counters
+	finally:
+		counters['calls'] += 1
+		counters['wall_seconds'] += time.time() - start_time
+		if start_cpu is not None:
+			counters['cpu_seconds'] += threadCpuTime() - start_cpu
+
+
+# Pool workers start each task without the stages of the tasks before
+def resetWorkers():
+	state['workers'] = {}
+
+
+def workerStages():
+	return state['workers']
+
+
+# Add the stages of other processes (returned by their tasks) to the ones of this one
+def mergeInstrumentation(workers):
+	for worker, stages in workers.items():
+		for stage, counters in stages.items():
+			addCounters(state['workers'].setdefault(worker, {}).setdefault(stage, newCounters()), counters)
+
+
+def writeInstrumentationReport(report_file, script, version, start_time):
+	stages = {}
+	for worker_stages in state['workers'].values():
+		for stage, counters in worker_stages.items():
+			addCounters(stages.setdefault(stage, newCounters()), counters)
+	for counters in stages.values():
+		counters['mb_per_second'] = round(counters['bytes'] / 1024.0 / 1024.0 / counters['wall_seconds'], 2) if counters['wall_seconds'] > 0 else None
+		counters['records_per_second'] = round(counters['records'] / counters['wall_seconds'], 1) if counters['wall_seconds'] > 0 else None
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+	report = {'script': script, 'version': version, 'wall_seconds': round(time.time() - start_time, 4), 'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 4), 'children_cpu_seconds': round(children_usage.ru_utime + children_usage.ru_stime, 4), 'peak_rss_kb': usage.ru_maxrss, 'children_peak_rss_kb': children_usage.ru_maxrss, 'stages': stages, 'workers': state['workers']}
+	with open(report_file, 'wt') as writer:
+		json.dump(report, writer, indent=1, sort_keys=True)
+
+
+# cProfile of the calling thread, with --profile
+@contextlib.contextmanager
+def profiled():
+	if state['profile_directory'] is None:
+		yield
+		return
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		yield
+	finally:
+		profiler.disable()
+		profile_file, profile_file_path = tempfile.mkstemp(suffix='.pstats', dir=state['profile_directory'])
+		os.close(profile_file)
+		profiler.dump_stats(profile_file_path)
+
+
+# Pool task (function, function_args) with its own stages. Returns the task, its result
+# or its traceback, and its stages
+def runPoolTask(task):
+	function, function_args = task
+	resetWorkers()
+	try:
+		with profiled():
+			return task, function(*function_args), None, workerStages()
+	except (Exception, SystemExit):
+		return task, None, traceback.format_exc(), workerStages()
+
+
+# All the profiles together in <prefix>.pstats, and their top functions in <prefix>.txt
+def collectProfiles(prefix):
+	profile_files = [os.path.join(state['profile_directory'], profile_file) for profile_file in os.listdir(state['profile_directory']) if profile_file.endswith('.pstats')]
+	profile_files = [profile_file for profile_file in profile_files if os.path.getsize(profile_file) > 0]
+	if len(profile_files) > 0:
+		stats = pstats.Stats(*profile_files)
+		stats.dump_stats(prefix + '.pstats')
+		with open(prefix + '.txt', 'wt') as writer:
+			pstats.Stats(prefix + '.pstats', stream=writer).sort_stats('cumulative').print_stats(50)
+	shutil.rmtree(state['profile_directory'], True)
+	state['profile_directory'] = None
+
+
+# Run function(*function_args) of script, writing <script>.instrumentation.json and, with
+# profile, <script>.profile.pstats and <script>.profile.txt to outdir
+def runInstrumented(function, function_args, outdir, script, version, profile):
+	prefix = os.path.join(outdir, os.path.splitext(script)[0])
+	# Set before the pools are created, so that their workers profile too
+	if profile:
+		state['profile_directory'] = tempfile.mkdtemp(prefix='profile.', dir=outdir)
+	start_time = time.time()
+	try:
+		with profiled():
+			return function(*function_args)
+	finally:
+		if os.path.isdir(outdir):
+			writeInstrumentationReport(prefix + '.instrumentation.json', script, version, start_time)
+		if state['profile_directory'] is not None:
+			collectProfiles(prefix + '.profile')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+"""
+lookupcache.py - SQLite cache of accession lookups shared by the scripts
+<https://github.com/miguelpmachado/pythonScripts>
+
+Copyright (C) 2026 Miguel Machado <mpmachado@medicina.ulisboa.pt>
+
+Last modified: October 18, 2026
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import sqlite3
+import pickle
+
+import instrumentation
+
+
+# Entries older than ttl_days are looked up again (unless offline). The least recently
+# used entries above max_entries are evicted by evict_cache, once per run
+def open_cache(cache_file, ttl_days, max_entries, offline):
+	cache_directory = os.path.dirname(os.path.abspath(cache_file))
+	if not os.path.isdir(cache_directory):
+		os.makedirs(cache_directory)
+	connection = sqlite3.connect(cache_file, timeout=60)
+	connection.execute('CREATE TABLE IF NOT EXISTS accessions (namespace TEXT NOT NULL, accession TEXT NOT NULL, value BLOB NOT NULL, stored REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, accession))')
+	connection.execute('CREATE INDEX IF NOT EXISTS accessions_accessed ON accessions (accessed)')
+	connection.commit()
+	return {'connection': connection, 'ttl': ttl_days * 24 * 3600, 'max_entries': max_entries, 'offline': offline, 'accessed': []}
+
+
+def cache_get(cache, namespace, accession):
+	with instrumentation.timedStage('cache') as stage:
+		stage['records'] += 1
+		return cache_lookup(cache, namespace, accession)
+
+
+def cache_lookup(cache, namespace, accession):
+	row = cache['connection'].execute('SELECT value, stored FROM accessions WHERE namespace = ? AND accession = ?', (namespace, accession)).fetchone()
+	if row is None:
+		return None
+	# Without network, old entries are better than nothing
+	if cache['ttl'] > 0 and time.time() - row[1] > cache['ttl'] and not cache['offline']:
+		return None
+	# Written by commit_cache, so that no write transaction is left open
+	cache['accessed'].append((time.time(), namespace, accession))
+	return pickle.loads(str(row[0]))
+
+
+# Store the values of many accessions ([accession, value] pairs) in a single transaction
+def cache_put(cache, namespace, values):
+	if len(values) == 0:
+		return
+	with instrumentation.timedStage('cache') as stage:
+		now = time.time()
+		cache['connection'].executemany('INSERT OR REPLACE INTO accessions (namespace, accession, value, stored, accessed) VALUES (?, ?, ?, ?, ?)', [(namespace, accession, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), now, now) for accession, value in values])
+		cache['connection'].commit()
+		stage['records'] += len(values)
+
+
+# Store the access times of the entries read, to be called before any network request
+def commit_cache(cache):
+	if len(cache['accessed']) > 0:
+		cache['connection'].executemany('UPDATE accessions SET accessed = ? WHERE namespace = ? AND accession = ?', cache['accessed'])
+		cache['accessed'] = []
+	cache['connection'].commit()
+
+
+# Holds the write lock of the cache while the entries are deleted, so it is not run by
+# the workers
+def evict_cache(cache):
+	commit_cache(cache)
+	if cache['max_entries'] > 0:
+		with instrumentation.timedStage('cache_eviction'):
+			cache['connection'].execute('DELETE FROM accessions WHERE rowid IN (SELECT rowid FROM accessions ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (cache['max_entries'],))
+			cache['connection'].commit()
+
+
+def close_cache(cache):
+	commit_cache(cache)
+	cache['connection'].close()
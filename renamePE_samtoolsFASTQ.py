@@ -9,7 +9,7 @@ that were not include in samtools fastq command
 
 Copyright (C) 2017 Miguel Machado <mpmachado@medicina.ulisboa.pt>
 
-Last modified: January 10, 2017
+Last modified: October 18, 2026
 
 This program is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
@@ -30,68 +30,467 @@ import sys
 import time
 import argparse
 import itertools
+import operator
+import contextlib
+import subprocess
+import threading
+import Queue
+import multiprocessing
+import glob
+import re
+import gzip
+
+import fastqio
+import instrumentation
 
 
 version = '0.1'
 
+block_size = 8 * 1024 * 1024
+# Blocks held by each queue of the pipeline engine
+pipeline_queue_size = 4
 
-def formartFastqHeaders(in_fastq_1, in_fastq_2, outdir):
-	out_fastq_1 = os.path.join(outdir, os.path.splitext(os.path.basename(in_fastq_1))[0] + '.headersRenamed_1.fq')
-	out_fastq_2 = os.path.join(outdir, os.path.splitext(os.path.basename(in_fastq_2))[0] + '.headersRenamed_2.fq')
-	writer_in_fastq_1 = open(out_fastq_1, 'wt')
-	writer_in_fastq_2 = open(out_fastq_2, 'wt')
-	outfiles = [out_fastq_1, out_fastq_2]
-	with open(in_fastq_1, 'rtU') as reader_in_fastq_1, open(in_fastq_2, 'rtU') as reader_in_fastq_2:
-		plus_line = True
-		quality_line = True
-		number_reads = 0
-		for in_1, in_2 in itertools.izip(reader_in_fastq_1, reader_in_fastq_2):
-			if len(in_1) > 0:
-				in_1 = in_1.splitlines()[0]
-				in_2 = in_2.splitlines()[0]
-				if in_1.startswith('@') and plus_line and quality_line:
-					if in_1 != in_2:
-						sys.exit('The PE fastq files are not aligned properly!')
-					in_1 += '/1' + '\n'
-					in_2 += '/2' + '\n'
-					writer_in_fastq_1.write(in_1)
-					writer_in_fastq_2.write(in_2)
-					plus_line = False
-					quality_line = False
-				elif in_1.startswith('+') and not plus_line:
-					in_1 += '\n'
-					writer_in_fastq_1.write(in_1)
-					writer_in_fastq_2.write(in_1)
-					plus_line = True
-				elif plus_line and not quality_line:
-					in_1 += '\n'
-					in_2 += '\n'
-					writer_in_fastq_1.write(in_1)
-					writer_in_fastq_2.write(in_2)
-					writer_in_fastq_1.flush()
-					writer_in_fastq_2.flush()
-					number_reads += 1
-					quality_line = True
-				else:
-					in_1 += '\n'
-					in_2 += '\n'
-					writer_in_fastq_1.write(in_1)
-					writer_in_fastq_2.write(in_2)
-	return number_reads, outfiles
+# External compressors of the outputs, the parallel one first
+compressors = ['pigz', 'gzip']
 
+# Mate number in the name of a fastq file (as in sample_1.fq, sample_R1.fastq.gz or
+# sample.1.fq), the last match being taken
+mate_pattern = re.compile(r'([._]R?)([12])(?=[._])')
 
-def compressionType(file_to_test):
-	magic_dict = {'\x1f\x8b\x08': ['gzip', 'gunzip'], '\x42\x5a\x68': ['bzip2', 'bunzip2']}
 
-	max_len = max(len(x) for x in magic_dict)
+def renamedFastqPath(in_fastq, outdir, mate, compress_output):
+	in_fastq = os.path.basename(in_fastq)
+	if os.path.splitext(in_fastq)[1] in ('.gz', '.bz2'):
+		in_fastq = os.path.splitext(in_fastq)[0]
+	return os.path.join(outdir, os.path.splitext(in_fastq)[0] + '.headersRenamed_' + str(mate) + '.fq' + ('.gz' if compress_output else ''))
 
-	with open(file_to_test, 'r') as reader:
-		file_start = reader.read(max_len)
 
-	for magic, filetype in magic_dict.items():
-		if file_start.startswith(magic):
-			return filetype
-	return None
+def formartFastqHeaders(in_fastq_1, in_fastq_2, outdir, compress_output=False, engine='block'):
+	out_fastq_1 = renamedFastqPath(in_fastq_1, outdir, 1, compress_output)
+	out_fastq_2 = renamedFastqPath(in_fastq_2, outdir, 2, compress_output)
+	outfiles = [out_fastq_1, out_fastq_2]
+	# Includes all the other stages of the pair
+	with instrumentation.timedStage('rename_pair') as stage:
+		with fastqio.openFastq(in_fastq_1, engine != 'line') as reader_in_fastq_1, fastqio.openFastq(in_fastq_2, engine != 'line') as reader_in_fastq_2, openFastqWriter(out_fastq_1, compress_output) as writer_in_fastq_1, openFastqWriter(out_fastq_2, compress_output) as writer_in_fastq_2:
+			if engine == 'line':
+				with instrumentation.timedStage('rename_lines') as line_stage:
+					number_reads = renameFastqLines(reader_in_fastq_1, reader_in_fastq_2, writer_in_fastq_1, writer_in_fastq_2)
+					line_stage['records'] += number_reads
+			else:
+				blocks_1 = readFastqBlockLines(reader_in_fastq_1, fastqio.compressionType(in_fastq_1) is None)
+				blocks_2 = readFastqBlockLines(reader_in_fastq_2, fastqio.compressionType(in_fastq_2) is None)
+				if engine == 'pipeline':
+					number_reads = renameFastqPipeline(blocks_1, blocks_2, writer_in_fastq_1, writer_in_fastq_2)
+				else:
+					number_reads = renameFastqBlocks(blocks_1, blocks_2, timedWrite(writer_in_fastq_1.write), timedWrite(writer_in_fastq_2.write))
+		stage['bytes'] += os.path.getsize(in_fastq_1) + os.path.getsize(in_fastq_2)
+		stage['records'] += number_reads
+	return number_reads, outfiles
+
+
+# Original line by line renaming, reading and writing both mates in lockstep
+def renameFastqLines(reader_in_fastq_1, reader_in_fastq_2, writer_in_fastq_1, writer_in_fastq_2):
+	plus_line = True
+	quality_line = True
+	number_reads = 0
+	for in_1, in_2 in itertools.izip(reader_in_fastq_1, reader_in_fastq_2):
+		if len(in_1) > 0:
+			in_1 = in_1.splitlines()[0]
+			in_2 = in_2.splitlines()[0]
+			if in_1.startswith('@') and plus_line and quality_line:
+				if in_1 != in_2:
+					sys.exit('The PE fastq files are not aligned properly!')
+				in_1 += '/1' + '\n'
+				in_2 += '/2' + '\n'
+				writer_in_fastq_1.write(in_1)
+				writer_in_fastq_2.write(in_2)
+				plus_line = False
+				quality_line = False
+			elif in_1.startswith('+') and not plus_line:
+				in_1 += '\n'
+				writer_in_fastq_1.write(in_1)
+				writer_in_fastq_2.write(in_1)
+				plus_line = True
+			elif plus_line and not quality_line:
+				in_1 += '\n'
+				in_2 += '\n'
+				writer_in_fastq_1.write(in_1)
+				writer_in_fastq_2.write(in_2)
+				writer_in_fastq_1.flush()
+				writer_in_fastq_2.flush()
+				number_reads += 1
+				quality_line = True
+			else:
+				in_1 += '\n'
+				in_2 += '\n'
+				writer_in_fastq_1.write(in_1)
+				writer_in_fastq_2.write(in_2)
+	return number_reads
+
+
+# Read the file in big binary blocks and yield the lines of each block, split as the line engine does
+def readFastqBlockLines(reader, universal_newlines):
+	buffer = bytearray(block_size)
+	remainder = ''
+	while True:
+		# Waiting for the decompressor, for compressed files
+		with instrumentation.timedStage('read') as stage:
+			bytes_read = reader.readinto(buffer)
+			stage['bytes'] += bytes_read or 0
+		if not bytes_read:
+			break
+		block = remainder + str(buffer[:bytes_read])
+		cut = block.rfind('\n') + 1
+		if cut == 0:
+			remainder = block
+			continue
+		remainder = block[cut:]
+		yield splitBlockLines(block[:cut], universal_newlines)
+	if len(remainder) > 0:
+		yield splitBlockLines(remainder, universal_newlines)
+
+
+def splitBlockLines(block, universal_newlines):
+	with instrumentation.timedStage('split_lines') as stage:
+		stage['bytes'] += len(block)
+		return splitLines(block, universal_newlines)
+
+
+def splitLines(block, universal_newlines):
+	if '\r' in block:
+		if universal_newlines:
+			block = block.replace('\r\n', '\n').replace('\r', '\n')
+			lines = block.split('\n')
+		else:
+			lines = [line.split('\r', 1)[0] for line in block.split('\n')]
+	else:
+		lines = block.split('\n')
+	if block.endswith('\n'):
+		lines.pop()
+	return lines
+
+
+starts_with_at = operator.methodcaller('startswith', '@')
+starts_with_plus = operator.methodcaller('startswith', '+')
+
+
+# Rename plain four line records of both mates at once. Returns None when some record
+# is not a plain record or the headers of the mates differ (the line by line renaming
+# must then take care of these lines)
+def renameFastqRecords(lines_1, lines_2):
+	headers_1 = lines_1[0::4]
+	headers_2 = lines_2[0::4]
+	pluses = lines_1[2::4]
+	if headers_1 != headers_2 or not all(map(starts_with_at, headers_1)) or any(map(starts_with_plus, lines_1[1::4])) or not all(map(starts_with_plus, pluses)):
+		return None
+	lines_1 = list(lines_1)
+	lines_1[0::4] = [header + '/1' for header in headers_1]
+	lines_2 = list(lines_2)
+	lines_2[0::4] = [header + '/2' for header in headers_2]
+	# Mate 2 gets the plus lines of mate 1, as in the line by line renaming
+	lines_2[2::4] = pluses
+	return lines_1, lines_2, len(headers_1)
+
+
+# Line by line renaming of paired lines (the same rules as renameFastqLines), keeping
+# its state in rename_state ([plus_line, quality_line, number_reads]). Returns the
+# renamed lines and if the mates were aligned up to the end of the lines
+def renamePairedLines(lines_1, lines_2, rename_state):
+	plus_line, quality_line, number_reads = rename_state
+	out_1 = []
+	out_2 = []
+	aligned = True
+	for in_1, in_2 in itertools.izip(lines_1, lines_2):
+		if in_1.startswith('@') and plus_line and quality_line:
+			if in_1 != in_2:
+				aligned = False
+				break
+			out_1.append(in_1 + '/1')
+			out_2.append(in_2 + '/2')
+			plus_line = False
+			quality_line = False
+		elif in_1.startswith('+') and not plus_line:
+			out_1.append(in_1)
+			out_2.append(in_1)
+			plus_line = True
+		elif plus_line and not quality_line:
+			out_1.append(in_1)
+			out_2.append(in_2)
+			number_reads += 1
+			quality_line = True
+		else:
+			out_1.append(in_1)
+			out_2.append(in_2)
+	rename_state[:] = [plus_line, quality_line, number_reads]
+	return out_1, out_2, aligned
+
+
+def writeLines(write, lines):
+	if len(lines) > 0:
+		write('\n'.join(lines) + '\n')
+
+
+# Write function that times the writing (and compression, with the gzip module) as the
+# write stage
+def timedWrite(write):
+	def writeData(data):
+		with instrumentation.timedStage('write') as stage:
+			write(data)
+			stage['bytes'] += len(data)
+	return writeData
+
+
+# Rename the blocks of lines of both mates, pairing the lines as they come (the blocks
+# of each mate hold different numbers of lines). Whole blocks of plain records are
+# renamed at once and written with a single call to the write function of each output
+def renameFastqBlocks(blocks_1, blocks_2, write_fastq_1, write_fastq_2):
+	rename_state = [True, True, 0]
+	pending_1 = []
+	pending_2 = []
+	while True:
+		if len(pending_1) <= len(pending_2):
+			lines = next(blocks_1, None)
+			if lines is None:
+				break
+			pending_1 += lines
+		else:
+			lines = next(blocks_2, None)
+			if lines is None:
+				break
+			pending_2 += lines
+		# Only multiples of four lines, so that the records are renamed whole
+		number_lines = min(len(pending_1), len(pending_2))
+		number_lines -= number_lines % 4
+		if number_lines == 0:
+			continue
+		lines_1 = pending_1[:number_lines]
+		lines_2 = pending_2[:number_lines]
+		del pending_1[:number_lines]
+		del pending_2[:number_lines]
+
+		with instrumentation.timedStage('rename') as stage:
+			number_reads = rename_state[2]
+			renamed = None
+			if rename_state[0] and rename_state[1]:
+				renamed = renameFastqRecords(lines_1, lines_2)
+			if renamed is not None:
+				lines_1, lines_2, number_records = renamed
+				rename_state[2] += number_records
+				aligned = True
+			else:
+				lines_1, lines_2, aligned = renamePairedLines(lines_1, lines_2, rename_state)
+			stage['records'] += rename_state[2] - number_reads
+		writeLines(write_fastq_1, lines_1)
+		writeLines(write_fastq_2, lines_2)
+		if not aligned:
+			sys.exit('The PE fastq files are not aligned properly!')
+
+	# Lines left of both mates (the lines of the longest file beyond the end of the
+	# other are ignored, as in the line by line renaming)
+	lines_1, lines_2, aligned = renamePairedLines(pending_1, pending_2, rename_state)
+	writeLines(write_fastq_1, lines_1)
+	writeLines(write_fastq_2, lines_2)
+	if not aligned:
+		sys.exit('The PE fastq files are not aligned properly!')
+	return rename_state[2]
+
+
+# Reader stage of the pipeline engine: put the blocks of lines of one mate in
+# block_queue (None at the end), until the validation stage no longer needs them
+def queueBlocks(blocks, block_queue, stop, errors):
+	try:
+		with instrumentation.profiled():
+			for lines in blocks:
+				if stop.is_set():
+					break
+				block_queue.put(lines)
+	except Exception as e:
+		errors.append(e)
+	finally:
+		block_queue.put(None)
+
+
+def iterQueue(block_queue):
+	for lines in iter(block_queue.get, None):
+		yield lines
+
+
+# Writer stage of the pipeline engine. After an error the data is still taken from the
+# queue (and discarded), so that the validation stage never waits for it
+def writeQueuedBlocks(block_queue, writer, errors):
+	failed = False
+	write = timedWrite(writer.write)
+	with instrumentation.profiled():
+		for data in iter(block_queue.get, None):
+			if not failed:
+				try:
+					write(data)
+				except Exception as e:
+					errors.append(e)
+					failed = True
+
+
+# Pipelined renaming: one reader per mate, the pair validation and renaming (see
+# renameFastqBlocks) and one writer per output, each on its own thread and connected by
+# bounded queues of blocks. Decompression and compression run in their own processes
+# (see openFastq and openFastqWriter), so each stream goes at its own pace
+def renameFastqPipeline(blocks_1, blocks_2, writer_in_fastq_1, writer_in_fastq_2):
+	errors = []
+	stop = threading.Event()
+	read_queues = [Queue.Queue(pipeline_queue_size), Queue.Queue(pipeline_queue_size)]
+	write_queues = [Queue.Queue(pipeline_queue_size), Queue.Queue(pipeline_queue_size)]
+	readers = [threading.Thread(target=queueBlocks, args=(blocks, block_queue, stop, errors,)) for blocks, block_queue in zip([blocks_1, blocks_2], read_queues)]
+	writers = [threading.Thread(target=writeQueuedBlocks, args=(block_queue, writer, errors,)) for block_queue, writer in zip(write_queues, [writer_in_fastq_1, writer_in_fastq_2])]
+	for thread in readers + writers:
+		thread.daemon = True
+		thread.start()
+
+	try:
+		number_reads = renameFastqBlocks(iterQueue(read_queues[0]), iterQueue(read_queues[1]), write_queues[0].put, write_queues[1].put)
+	finally:
+		for block_queue in write_queues:
+			block_queue.put(None)
+		for thread in writers:
+			thread.join()
+		# The reader of the longest file (or of both, after an error) may still be waiting
+		stop.set()
+		for thread, block_queue in zip(readers, read_queues):
+			while thread.is_alive():
+				try:
+					block_queue.get(timeout=0.1)
+				except Queue.Empty:
+					pass
+	if len(errors) > 0:
+		raise errors[0]
+	return number_reads
+
+
+# Open an output fastq file. With compress_output, the data is gzip compressed by an
+# external process (pigz or gzip) running alongside, or in-process if none is found
+@contextlib.contextmanager
+def openFastqWriter(out_fastq, compress_output):
+	if not compress_output:
+		with open(out_fastq, 'wt') as writer:
+			yield writer
+		return
+
+	compressor = fastqio.findProgram(compressors)
+	if compressor is None:
+		with gzip.open(out_fastq, 'wb') as writer:
+			yield writer
+		return
+
+	with open(out_fastq, 'wb') as out_file:
+		proc = subprocess.Popen([compressor, '-c'], stdin=subprocess.PIPE, stdout=out_file, stderr=subprocess.PIPE)
+		try:
+			yield proc.stdin
+		finally:
+			proc.stdin.close()
+			stderr = proc.stderr.read()
+			proc.stderr.close()
+			proc.wait()
+	if proc.returncode != 0:
+		raise IOError('It was not possible to compress ' + out_fastq + ': ' + stderr.strip())
+
+
+# Pairs of fastq files listed in a sample sheet, one pair per line, tab separated:
+# sample name, mate 1 file and mate 2 file (the sample name may be left out)
+def readSampleSheet(sample_sheet):
+	pairs = []
+	with open(sample_sheet, 'rtU') as reader:
+		for line in reader:
+			line = line.splitlines()[0]
+			if len(line) > 0 and not line.startswith('#'):
+				line = line.split('\t')
+				if len(line) == 2:
+					line = [fastqSampleName(line[0])] + line
+				if len(line) != 3:
+					raise ValueError('Sample sheet lines must have the sample name (optional), the mate 1 file and the mate 2 file: ' + '\t'.join(line))
+				pairs.append([line[0], os.path.abspath(line[1]), os.path.abspath(line[2])])
+	return pairs
+
+
+def fastqSampleName(fastq):
+	name = os.path.basename(fastq)
+	matches = list(mate_pattern.finditer(name))
+	if len(matches) > 0:
+		name = name[:matches[-1].start()]
+	else:
+		for extension in ('.gz', '.bz2', '.fq', '.fastq'):
+			if name.endswith(extension):
+				name = name[:-len(extension)]
+	return name
+
+
+# Pairs of fastq files from a glob matching the mate 1 files, the mate 2 files having
+# the same name with the mate number changed
+def globPairs(pattern):
+	pairs = []
+	for fastq_1 in sorted(glob.glob(pattern)):
+		name = os.path.basename(fastq_1)
+		matches = [match for match in mate_pattern.finditer(name) if match.group(2) == '1']
+		if len(matches) == 0:
+			raise ValueError('The mate number was not found in the name of ' + fastq_1)
+		mate = matches[-1]
+		fastq_2 = os.path.join(os.path.dirname(fastq_1), name[:mate.start(2)] + '2' + name[mate.end(2):])
+		# The mate 2 file may be compressed differently
+		if not os.path.isfile(fastq_2):
+			fastq_2_base = fastq_2[:-len(os.path.splitext(fastq_2)[1])] if os.path.splitext(fastq_2)[1] in ('.gz', '.bz2') else fastq_2
+			for candidate in (fastq_2_base, fastq_2_base + '.gz', fastq_2_base + '.bz2'):
+				if os.path.isfile(candidate):
+					fastq_2 = candidate
+					break
+		pairs.append([fastqSampleName(fastq_1), os.path.abspath(fastq_1), os.path.abspath(fastq_2)])
+	return pairs
+
+
+# Rename one pair of the batch mode, in a pool worker
+def renamePairTask(pair, outdir, compress_output, engine):
+	start_time = time.time()
+	number_reads = None
+	outfiles = []
+	error = None
+	try:
+		for fastq in pair[1:]:
+			if not os.path.isfile(fastq):
+				raise IOError('File not found: ' + fastq)
+		number_reads, outfiles = formartFastqHeaders(pair[1], pair[2], outdir, compress_output, engine)
+	except SystemExit as e:
+		error = str(e)
+	except (IOError, OSError, ValueError) as e:
+		error = str(e)
+	return number_reads, outfiles, time.time() - start_time, error
+
+
+# Rename all the pairs with a pool of processes and write one summary for all of them.
+# Returns the number of pairs that failed
+def runBatch(pairs, outdir, compress_output, engine, threads):
+	summary_file = os.path.join(outdir, 'renamePE_samtoolsFASTQ.summary.tab')
+	number_failures = 0
+	with open(summary_file, 'wt') as writer:
+		writer.write('\t'.join(['#sample', 'fastq_1', 'fastq_2', 'number_read_pairs', 'runtime_seconds', 'status', 'outfiles_or_error']) + '\n')
+		pool = multiprocessing.Pool(processes=threads)
+		tasks = [(renamePairTask, (pair, outdir, compress_output, engine,)) for pair in pairs]
+		# Each summary row is written as soon as its pair is done
+		for task, result, error, pair_instrumentation in pool.imap_unordered(instrumentation.runPoolTask, tasks):
+			instrumentation.mergeInstrumentation(pair_instrumentation)
+			pair = task[1][0]
+			number_reads, outfiles, time_taken = None, [], None
+			if error is None:
+				number_reads, outfiles, time_taken, error = result
+			if error is None:
+				status = 'OK'
+				details = ','.join(outfiles)
+			else:
+				status = 'FAILED'
+				details = ' '.join(error.split())
+				number_failures += 1
+			writer.write('\t'.join(pair + [str(number_reads) if number_reads is not None else 'NA', str(round(time_taken, 2)) if time_taken is not None else 'NA', status, details]) + '\n')
+			writer.flush()
+		pool.close()
+		pool.join()
+	print 'It was renamed ' + str(len(pairs) - number_failures) + ' of ' + str(len(pairs)) + ' pairs (summary in ' + summary_file + ')' + '\n'
+	return number_failures
 
 
 def runTime(start_time):
@@ -103,41 +502,81 @@ def runTime(start_time):
 	return time_taken
 
 
+def renamePE(args, batch_mode, outdir, start_time):
+	print '\n' + 'STARTING renamePE_samtoolsFASTQ.py' + '\n'
+
+	if batch_mode:
+		pairs = []
+		try:
+			if args.sampleSheet is not None:
+				pairs.extend(readSampleSheet(args.sampleSheet.name))
+			if args.pairsGlob is not None:
+				pairs.extend(globPairs(args.pairsGlob))
+		except ValueError as e:
+			sys.exit(str(e))
+		outfiles = [renamedFastqPath(fastq, outdir, mate, args.gzipOutput) for pair in pairs for mate, fastq in ((1, pair[1]), (2, pair[2]))]
+		if len(set(outfiles)) != len(outfiles):
+			sys.exit('Different pairs would be written to the same output files!')
+
+		print 'Renaming fastq headers of ' + str(len(pairs)) + ' pairs' + '\n'
+		number_failures = runBatch(pairs, outdir, args.gzipOutput, args.engine, args.threads)
+
+		print '\n' + 'END renamePE_samtoolsFASTQ.py'
+		time_taken = runTime(start_time)
+		del time_taken
+		if number_failures > 0:
+			sys.exit('It was not possible to rename ' + str(number_failures) + ' pairs!')
+		return
+
+	fastq_files = [os.path.abspath(args.fastq_1.name), os.path.abspath(args.fastq_2.name)]
+
+	print 'Check if files are compressed' + '\n'
+	for fastq in fastq_files:
+		compression = fastqio.compressionType(fastq)
+		if compression is not None:
+			print fastq + ' is ' + compression[0] + ' compressed' + '\n'
+
+	print 'Renaming fastq headers' + '\n'
+	number_reads, outfiles = formartFastqHeaders(fastq_files[0], fastq_files[1], outdir, args.gzipOutput, args.engine)
+
+	print 'It was written ' + str(number_reads) + ' read pairs in ' + str(outfiles) + ' files' + '\n'
+
+	print '\n' + 'END renamePE_samtoolsFASTQ.py'
+	time_taken = runTime(start_time)
+	del time_taken
+
+
 def main():
 	parser = argparse.ArgumentParser(prog='renamePE_samtoolsFASTQ.py', description='Rename the fastq headers with PE terminations that were not include in samtools fastq command', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument('--version', help='Version information', action='version', version=str('%(prog)s v' + version))
 
-	parser_required = parser.add_argument_group('Required options')
-	parser_required.add_argument('-1', '--fastq_1', type=argparse.FileType('r'), metavar='/path/to/input/file_1.fq', help='Uncompressed fastq file containing mate 1 reads', required=True)
-	parser_required.add_argument('-2', '--fastq_2', type=argparse.FileType('r'), metavar='/path/to/input/file_2.fq', help='Uncompressed fastq file containing mate 2 reads', required=True)
+	parser_required = parser.add_argument_group('Required options (one pair, or a batch of pairs with --sampleSheet or --pairsGlob)')
+	parser_required.add_argument('-1', '--fastq_1', type=argparse.FileType('r'), metavar='/path/to/input/file_1.fq', help='Fastq file containing mate 1 reads (uncompressed or compressed with gzip or bzip2)', required=False)
+	parser_required.add_argument('-2', '--fastq_2', type=argparse.FileType('r'), metavar='/path/to/input/file_2.fq', help='Fastq file containing mate 2 reads (uncompressed or compressed with gzip or bzip2)', required=False)
+	parser_required.add_argument('--sampleSheet', type=argparse.FileType('r'), metavar='/path/to/sample_sheet.tab', help='Tab separated file with one pair per line: sample name (optional), mate 1 fastq and mate 2 fastq', required=False)
+	parser_required.add_argument('--pairsGlob', type=str, metavar='"/path/to/*_1.fq.gz"', help='Glob (between quotes) matching the mate 1 fastq files, the mate 2 files having the same name with 2 as mate number (as in _2, _R2 or .2)', required=False)
 
 	parser_optional_general = parser.add_argument_group('General facultative options')
 	parser_optional_general.add_argument('-o', '--outdir', type=str, metavar='/output/directory/', help='Path for output directory', required=False, default='.')
+	parser_optional_general.add_argument('-z', '--gzipOutput', action='store_true', help='Write gzip compressed output fastq files')
+	parser_optional_general.add_argument('-j', '--threads', type=int, metavar='N', help='Number of pairs renamed at the same time in batch mode', required=False, default=1)
+	parser_optional_general.add_argument('--profile', action='store_true', help='Profile the renaming with cProfile (all processes and threads together in renamePE_samtoolsFASTQ.profile.pstats and the top functions in renamePE_samtoolsFASTQ.profile.txt, in outdir)')
+	parser_optional_general.add_argument('--engine', choices=['block', 'pipeline', 'line'], help='Renaming engine to use: "block" renames the records over big binary blocks, "pipeline" does the same with the reading of each mate and the writing (and compression) of each output in parallel, "line" is the original line by line renaming', required=False, default='block')
 
 	args = parser.parse_args()
 
-	print '\n' + 'STARTING renamePE_samtoolsFASTQ.py' + '\n'
-	start_time = time.time()
-
-	fastq_files = [os.path.abspath(args.fastq_1.name), os.path.abspath(args.fastq_2.name)]
-
-	print 'Check if files are compressed' + '\n'
-	for fastq in fastq_files:
-		if compressionType(fastq) is not None:
-			sys.exit('Compressed fastq files found')
+	batch_mode = args.sampleSheet is not None or args.pairsGlob is not None
+	if batch_mode and (args.fastq_1 is not None or args.fastq_2 is not None):
+		parser.error('-1/-2 cannot be used with --sampleSheet or --pairsGlob')
+	if not batch_mode and (args.fastq_1 is None or args.fastq_2 is None):
+		parser.error('-1 and -2 are required (or --sampleSheet or --pairsGlob for a batch of pairs)')
 
 	outdir = os.path.abspath(args.outdir)
 	if not os.path.isdir(outdir):
 		os.makedirs(outdir)
 
-	print 'Renaming fastq headers' + '\n'
-	number_reads, outfiles = formartFastqHeaders(fastq_files[0], fastq_files[1], outdir)
-
-	print 'It was written ' + str(number_reads) + ' read pairs in ' + str(outfiles) + ' files' + '\n'
-
-	print '\n' + 'END renamePE_samtoolsFASTQ.py'
-	time_taken = runTime(start_time)
-	del time_taken
+	# Timings of each stage go to renamePE_samtoolsFASTQ.instrumentation.json in outdir
+	instrumentation.runInstrumented(renamePE, (args, batch_mode, outdir, time.time(),), outdir, 'renamePE_samtoolsFASTQ.py', version, args.profile)
 
 
 if __name__ == "__main__":
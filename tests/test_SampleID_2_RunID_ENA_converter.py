@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SampleID_2_RunID_ENA_converter
+
+
+# Stand-in for the ENA server: keep-alive connections, and the answers of each path in
+# turn (the last one is repeated)
+class ENAHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	answers = {}
+	requests = []
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		ENAHandler.requests.append([self.client_address, self.path])
+		answers = ENAHandler.answers.get(self.path, [[404, {}, 'Not found']])
+		status, headers, body = answers.pop(0) if len(answers) > 1 else answers[0]
+		self.send_response(status)
+		for header, value in headers.items():
+			self.send_header(header, value)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+		if headers.get('Connection') == 'close':
+			self.close_connection = 1
+
+
+class ENAServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+
+# Answer of ENA with a SAMPLE (and its run) for each [accession, run]
+def samplesXml(samples):
+	return '<ROOT>' + ''.join('<SAMPLE accession="' + accession + '"><IDENTIFIERS><PRIMARY_ID>' + accession + '</PRIMARY_ID></IDENTIFIERS><SAMPLE_LINKS><SAMPLE_LINK><XREF_LINK><DB>ENA-RUN</DB><ID>' + run + '</ID></XREF_LINK></SAMPLE_LINK></SAMPLE_LINKS></SAMPLE>' for accession, run in samples) + '</ROOT>'
+
+
+class ENAServerTestCase(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ENAServer(('127.0.0.1', 0), ENAHandler)
+		cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+		cls.server_thread.daemon = True
+		cls.server_thread.start()
+		cls.base_url = 'http://127.0.0.1:' + str(cls.server.server_address[1])
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		ENAHandler.answers = {}
+		ENAHandler.requests = []
+		self.fetcher = SampleID_2_RunID_ENA_converter.build_fetcher(10, 2, 5)
+		# No rate limit, so that only the backoff waits are recorded
+		self.fetcher['interval'] = 0.0
+		self.sleeps = []
+		self.sleep = time.sleep
+		self.random = SampleID_2_RunID_ENA_converter.random.random
+		time.sleep = self.sleeps.append
+		SampleID_2_RunID_ENA_converter.random.random = lambda: 0.5
+
+	def tearDown(self):
+		time.sleep = self.sleep
+		SampleID_2_RunID_ENA_converter.random.random = self.random
+		for connection in getattr(self.fetcher['connections'], 'by_host', {}).values():
+			connection.close()
+
+
+class TestFetchUrl(ENAServerTestCase):
+	def fetch(self, path, read_content=None):
+		return SampleID_2_RunID_ENA_converter.fetch_url(self.fetcher, self.base_url + path, read_content)
+
+	def numberConnections(self):
+		return len(set(client_address for client_address, path in ENAHandler.requests))
+
+	def test_connection_reused(self):
+		ENAHandler.answers['/sample'] = [[200, {}, '<ROOT/>']]
+		for i in range(3):
+			self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		# The part of the response left unread by read_content does not get in the way
+		self.assertEqual(self.fetch('/sample', lambda response: response.read(2)), '<R')
+		self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		self.assertEqual(len(ENAHandler.requests), 5)
+		self.assertEqual(self.numberConnections(), 1)
+
+	def test_connection_closed_by_server(self):
+		ENAHandler.answers['/sample'] = [[200, {'Connection': 'close'}, '<ROOT/>']]
+		self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		self.assertEqual(self.numberConnections(), 2)
+
+	def test_unavailable_retried_with_backoff(self):
+		ENAHandler.answers['/sample'] = [[503, {}, 'Busy'], [503, {}, 'Busy'], [200, {}, '<ROOT/>']]
+		self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		self.assertEqual(self.sleeps, [1.0, 2.0])
+		self.assertEqual(self.numberConnections(), 1)
+
+	def test_retry_after(self):
+		ENAHandler.answers['/sample'] = [[429, {'Retry-After': '7'}, 'Slow down'], [200, {}, '<ROOT/>']]
+		self.assertEqual(self.fetch('/sample'), '<ROOT/>')
+		self.assertEqual(self.sleeps, [7])
+
+	def test_retries_exhausted(self):
+		ENAHandler.answers['/sample'] = [[503, {}, 'Busy']]
+		with self.assertRaises(IOError) as context:
+			self.fetch('/sample')
+		self.assertIn('HTTP 503', str(context.exception))
+		self.assertEqual(len(ENAHandler.requests), 3)
+
+	def test_not_found_not_retried(self):
+		with self.assertRaises(IOError):
+			self.fetch('/missing')
+		self.assertEqual(len(ENAHandler.requests), 1)
+		self.assertEqual(self.sleeps, [])
+
+	def test_redirections_followed(self):
+		ENAHandler.answers['/old'] = [[301, {'Location': self.base_url + '/moved'}, '']]
+		ENAHandler.answers['/moved'] = [[302, {'Location': '/sample?display=xml'}, '']]
+		ENAHandler.answers['/sample?display=xml'] = [[200, {}, '<ROOT/>']]
+		self.assertEqual(self.fetch('/old'), '<ROOT/>')
+		self.assertEqual([path for client_address, path in ENAHandler.requests], ['/old', '/moved', '/sample?display=xml'])
+		self.assertEqual(self.numberConnections(), 1)
+
+	def test_redirection_loop(self):
+		ENAHandler.answers['/loop'] = [[302, {'Location': '/loop'}, '']]
+		with self.assertRaises(IOError):
+			self.fetch('/loop')
+		self.assertEqual(len(ENAHandler.requests), 6)
+
+
+class TestSampleIDs2RunIDs(ENAServerTestCase):
+	def setUp(self):
+		ENAServerTestCase.setUp(self)
+		self.ena_view_url = SampleID_2_RunID_ENA_converter.ena_view_url
+		SampleID_2_RunID_ENA_converter.ena_view_url = self.base_url + '/ena/data/view/'
+
+	def tearDown(self):
+		SampleID_2_RunID_ENA_converter.ena_view_url = self.ena_view_url
+		ENAServerTestCase.tearDown(self)
+
+	def test_batch(self):
+		ENAHandler.answers['/ena/data/view/SAMEA1,SAMEA2&display=xml'] = [[200, {}, samplesXml([['SAMEA2', 'ERR2'], ['SAMEA1', 'ERR1']])]]
+		samples_info = SampleID_2_RunID_ENA_converter.sampleIDs_2_RunIDs(['SAMEA1', 'SAMEA2'], self.fetcher)
+		self.assertEqual(dict((sampleID, sample_info['ena_runs']) for sampleID, sample_info in samples_info.items()), {'SAMEA1': ['ERR1'], 'SAMEA2': ['ERR2']})
+		self.assertEqual(len(ENAHandler.requests), 1)
+
+	def test_samples_not_matched_asked_alone(self):
+		# ENA also finds samples by identifiers its answer does not have
+		ENAHandler.answers['/ena/data/view/SAMEA1,ALIAS2,MISSING3&display=xml'] = [[200, {}, samplesXml([['SAMEA1', 'ERR1'], ['SAMEA2', 'ERR2']])]]
+		ENAHandler.answers['/ena/data/view/ALIAS2&display=xml'] = [[200, {}, samplesXml([['SAMEA2', 'ERR2']])]]
+		ENAHandler.answers['/ena/data/view/MISSING3&display=xml'] = [[200, {}, '<ROOT/>']]
+		samples_info = SampleID_2_RunID_ENA_converter.sampleIDs_2_RunIDs(['SAMEA1', 'ALIAS2', 'MISSING3'], self.fetcher)
+		self.assertEqual(dict((sampleID, sample_info['ena_runs']) for sampleID, sample_info in samples_info.items()), {'SAMEA1': ['ERR1'], 'ALIAS2': ['ERR2'], 'MISSING3': []})
+		self.assertEqual([path for client_address, path in ENAHandler.requests], ['/ena/data/view/SAMEA1,ALIAS2,MISSING3&display=xml', '/ena/data/view/ALIAS2&display=xml', '/ena/data/view/MISSING3&display=xml'])
+
+	def test_failed_batch_asked_one_by_one(self):
+		ENAHandler.answers['/ena/data/view/SAMEA1,SAMEA2&display=xml'] = [[500, {}, 'Error']]
+		ENAHandler.answers['/ena/data/view/SAMEA1&display=xml'] = [[200, {}, samplesXml([['SAMEA1', 'ERR1']])]]
+		ENAHandler.answers['/ena/data/view/SAMEA2&display=xml'] = [[200, {}, samplesXml([['SAMEA2', 'ERR2']])]]
+		samples_info = SampleID_2_RunID_ENA_converter.sampleIDs_2_RunIDs(['SAMEA1', 'SAMEA2'], self.fetcher)
+		self.assertEqual(dict((sampleID, sample_info['ena_runs']) for sampleID, sample_info in samples_info.items()), {'SAMEA1': ['ERR1'], 'SAMEA2': ['ERR2']})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import gzip
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import checkFastqFiles
+
+
+def writeFastq(fastq, records):
+	with open(fastq, 'wt') as writer:
+		for name, sequence in records:
+			writer.write('@' + name + '\n' + sequence + '\n+\n' + 'I' * len(sequence) + '\n')
+
+
+class TestCheckFastqPair(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def checkPair(self, records_1, records_2):
+		fastq_1 = os.path.join(self.directory, 'a_1.fq')
+		fastq_2 = os.path.join(self.directory, 'a_2.fq')
+		writeFastq(fastq_1, records_1)
+		writeFastq(fastq_2, records_2)
+		return checkFastqFiles.checkFastqPair(fastq_1, fastq_2, 'block')
+
+	def test_zero_length_reads(self):
+		records = [['r1', 'ACGT'], ['r2', ''], ['r3', 'GG'], ['r4', '']]
+		result_1, result_2, pair_result = self.checkPair(records, records)
+		self.assertEqual(result_1[0], [4, 4, 4, 4])
+		self.assertEqual(result_2[0], [4, 4, 4, 4])
+		self.assertEqual(pair_result, {'concordant_pairs': 4, 'first_discordant': None})
+
+	def test_mate_suffixes(self):
+		records_1 = [['r' + str(i) + '/1', 'ACGT'] for i in range(10)]
+		records_2 = [['r' + str(i) + ' 2:N:0:ACGT', 'TT'] for i in range(10)]
+		result_1, result_2, pair_result = self.checkPair(records_1, records_2)
+		self.assertIsNone(pair_result['first_discordant'])
+
+	def test_first_discordant_record(self):
+		records_1 = [['r' + str(i), 'ACGT'] for i in range(10)]
+		records_2 = [['r' + str(i), 'ACGT'] for i in range(10)]
+		records_2[6][0] = 'x6'
+		result_1, result_2, pair_result = self.checkPair(records_1, records_2)
+		self.assertEqual(pair_result, {'concordant_pairs': 6, 'first_discordant': [7, 'r6', 'x6']})
+
+	def test_mate_with_fewer_reads(self):
+		records = [['r' + str(i), 'ACGT'] for i in range(10)]
+		result_1, result_2, pair_result = self.checkPair(records, records[:8])
+		self.assertEqual(pair_result, {'concordant_pairs': 8, 'first_discordant': [9, 'r8', None]})
+
+
+# Records of random reads, with some lines of the file then changed, removed or added
+def randomFastqLines(generator):
+	lines = []
+	for i in range(generator.randint(0, 30)):
+		length = generator.randint(0, 12)
+		lines += ['@r' + str(i), ''.join(generator.choice('ACGTN') for j in range(length)), '+', ''.join(generator.choice('@+!#I') for j in range(length))]
+	for i in range(generator.choice([0, 0, 1, 3])):
+		if len(lines) == 0:
+			break
+		line = generator.randrange(len(lines))
+		change = generator.randint(0, 4)
+		if change == 0:
+			del lines[line]
+		elif change == 1:
+			lines.insert(line, '')
+		elif change == 2:
+			lines[line] += 'A'
+		elif change == 3:
+			lines[line] = '+' + lines[line]
+		else:
+			lines[line] = '@' + lines[line]
+	return lines
+
+
+class TestEnginesAgree(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.block_size = checkFastqFiles.block_size
+		checkFastqFiles.block_size = 7
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'wt')
+
+	def tearDown(self):
+		sys.stdout.close()
+		sys.stdout = self.stdout
+		checkFastqFiles.block_size = self.block_size
+		shutil.rmtree(self.directory)
+
+	def checkEngines(self, data, compressed=False):
+		fastq = os.path.join(self.directory, 'a.fq' + ('.gz' if compressed else ''))
+		with (gzip.open(fastq, 'wb') if compressed else open(fastq, 'wb')) as writer:
+			writer.write(data)
+		line_result = checkFastqFiles.checkFastqFile(fastq, 'line', True)
+		block_result = checkFastqFiles.checkFastqFile(fastq, 'block', True)
+		self.assertEqual(block_result[:2], line_result[:2], repr(data))
+		return block_result[0]
+
+	def test_well_formed(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\nGG\n+r2\nII\n'
+		self.assertEqual(self.checkEngines(data), [2, 2, 2, 2])
+		self.assertEqual(self.checkEngines(data[:-1]), [2, 2, 2, 2])
+		self.assertEqual(self.checkEngines(data, True), [2, 2, 2, 2])
+
+	def test_crlf(self):
+		data = '@r1\r\nACGT\r\n+\r\nIIII\r\n@r2\r\nGG\r\n+\r\nII\r\n'
+		self.assertEqual(self.checkEngines(data), [2, 2, 2, 2])
+		self.assertEqual(self.checkEngines(data, True), [2, 2, 2, 2])
+		self.checkEngines(data.replace('\r\n', '\r'))
+
+	def test_truncated(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\nGGGG\n+\nII'
+		self.checkEngines(data)
+		self.checkEngines(data[:data.rindex('+')])
+		self.checkEngines(data, True)
+
+	def test_malformed(self):
+		records = ['@r1', 'ACGT', '+', 'IIII', '@r2', 'GGGG', '+', 'IIII', '@r3', 'TT', '+', 'II']
+		for line in range(len(records)):
+			for changed_records in (records[:line] + records[line + 1:], records[:line] + [''] + records[line:], records[:line] + [records[line] + 'A'] + records[line + 1:]):
+				self.checkEngines('\n'.join(changed_records) + '\n')
+				self.checkEngines('\r\n'.join(changed_records) + '\r\n')
+
+	def test_random_files(self):
+		generator = random.Random(1)
+		for i in range(300):
+			checkFastqFiles.block_size = generator.randint(1, 64)
+			new_line = generator.choice(['\n', '\n', '\r\n', '\r'])
+			self.checkEngines(new_line.join(randomFastqLines(generator)) + generator.choice(['', new_line, new_line + new_line]), generator.random() < 0.1)
+
+
+if __name__ == '__main__':
+	unittest.main()
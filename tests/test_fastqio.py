@@ -0,0 +1,55 @@
+import os
+import sys
+import bz2
+import gzip
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fastqio
+
+
+class TestOpenFastq(unittest.TestCase):
+	data = '@r1\nACGT\n+\nIIII\n' * 1000
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.findProgram = fastqio.findProgram
+		self.fastqs = {None: os.path.join(self.directory, 'a.fq'), 'gzip': os.path.join(self.directory, 'a.fq.gz'), 'bzip2': os.path.join(self.directory, 'a.fq.bz2')}
+		for compression, opener in ((None, open), ('gzip', gzip.open), ('bzip2', bz2.BZ2File)):
+			with opener(self.fastqs[compression], 'wb') as writer:
+				writer.write(self.data)
+
+	def tearDown(self):
+		fastqio.findProgram = self.findProgram
+		shutil.rmtree(self.directory)
+
+	def readFastqs(self):
+		for compression, fastq in self.fastqs.items():
+			self.assertEqual(fastqio.compressionType(fastq)[0] if compression is not None else None, compression)
+			for binary in (True, False):
+				with fastqio.openFastq(fastq, binary) as reader:
+					self.assertEqual(reader.read(), self.data)
+
+	def test_external_decompressors(self):
+		self.readFastqs()
+
+	def test_in_process_decompression(self):
+		fastqio.findProgram = lambda programs: None
+		self.readFastqs()
+
+	def test_corrupted_file(self):
+		with open(self.fastqs['gzip'], 'r+b') as writer:
+			writer.seek(20)
+			writer.write('corrupted')
+		for findProgram in (self.findProgram, lambda programs: None):
+			fastqio.findProgram = findProgram
+			with self.assertRaises(IOError):
+				with fastqio.openFastq(self.fastqs['gzip'], True) as reader:
+					reader.read()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import getCompleteGenomes
+
+
+class TestRenamedGenomeFiles(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.convert_accessions_2_gi = getCompleteGenomes.convert_accessions_2_gi
+		getCompleteGenomes.convert_accessions_2_gi = lambda accessions, cache=None: dict((accession, accession.split('_')[1]) for accession in accessions)
+
+	def tearDown(self):
+		getCompleteGenomes.convert_accessions_2_gi = self.convert_accessions_2_gi
+		shutil.rmtree(self.directory)
+
+	def renameGenome(self, sequence_lines):
+		genome = os.path.join(self.directory, 'genome.fna')
+		with open(genome, 'wt') as writer:
+			writer.write('>NC_1 desc\n' + '\n'.join(sequence_lines) + '\n')
+		renamed_fasta = genome + '.renamed.fasta'
+		getCompleteGenomes.renameSequences(genome, renamed_fasta, None, True)
+		return renamed_fasta
+
+	def test_regular_width_genome_indexed(self):
+		renamed_fasta = self.renameGenome(['ACGT', 'ACGT', 'AC'])
+		with open(renamed_fasta + '.fai', 'rt') as reader:
+			self.assertEqual(reader.read(), '\t'.join(['gi|1|', '10', '17', '4', '5']) + '\n')
+		self.assertFalse(os.path.isfile(renamed_fasta + '.fai.unindexable'))
+		self.assertFalse(getCompleteGenomes.renamedFilesMissing(renamed_fasta, True))
+
+	def test_irregular_width_genome_not_renamed_again(self):
+		renamed_fasta = self.renameGenome(['ACGT', 'AC', 'ACGT'])
+		self.assertFalse(os.path.isfile(renamed_fasta + '.fai'))
+		self.assertTrue(os.path.isfile(renamed_fasta + '.fai.unindexable'))
+		self.assertFalse(getCompleteGenomes.renamedFilesMissing(renamed_fasta, True))
+
+		# Without the summary (asked for in this run only) the genome is renamed again
+		os.remove(getCompleteGenomes.renamedFastaSummaryFile(renamed_fasta))
+		self.assertTrue(getCompleteGenomes.renamedFilesMissing(renamed_fasta, True))
+		self.assertFalse(getCompleteGenomes.renamedFilesMissing(renamed_fasta, False))
+
+	def test_index_replaces_marker(self):
+		self.renameGenome(['ACGT', 'AC', 'ACGT'])
+		renamed_fasta = self.renameGenome(['ACGT', 'ACGT'])
+		self.assertTrue(os.path.isfile(renamed_fasta + '.fai'))
+		self.assertFalse(os.path.isfile(renamed_fasta + '.fai.unindexable'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import instrumentation
+
+
+def busy(seconds):
+	end_time = time.time() + seconds
+	while time.time() < end_time:
+		pass
+
+
+class TestTimedStage(unittest.TestCase):
+	def setUp(self):
+		instrumentation.resetWorkers()
+
+	def tearDown(self):
+		instrumentation.resetWorkers()
+
+	@unittest.skipIf(instrumentation.rusage_thread is None, 'no per-thread CPU time on this platform')
+	def test_cpu_of_other_threads_not_counted(self):
+		# The stage only waits while another thread uses the CPU
+		thread = threading.Thread(target=busy, args=(0.5,))
+		with instrumentation.timedStage('wait') as stage:
+			thread.start()
+			thread.join()
+		self.assertEqual(stage['calls'], 1)
+		self.assertGreaterEqual(stage['wall_seconds'], 0.5)
+		self.assertLess(stage['cpu_seconds'], 0.25)
+
+	def test_stages_merged_by_worker(self):
+		with instrumentation.timedStage('read') as stage:
+			stage['records'] += 2
+		workers = instrumentation.workerStages()
+		instrumentation.resetWorkers()
+		instrumentation.mergeInstrumentation(workers)
+		instrumentation.mergeInstrumentation(workers)
+		self.assertEqual(instrumentation.stageCounters('read')['calls'], 2)
+		self.assertEqual(instrumentation.stageCounters('read')['records'], 4)
+
+	def test_pool_task_error_returned(self):
+		task = (int, ('not a number',))
+		returned_task, result, error, stages = instrumentation.runPoolTask(task)
+		self.assertEqual(returned_task, task)
+		self.assertIsNone(result)
+		self.assertIn('ValueError', error)
+		self.assertEqual(instrumentation.runPoolTask((int, ('7',)))[1:3], (7, None))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lookupcache
+
+
+class TestAccessionsCache(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.cache_file = os.path.join(self.directory, 'cache.sqlite')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_lookups_do_not_lock_the_cache(self):
+		cache = lookupcache.open_cache(self.cache_file, 0, 0, False)
+		lookupcache.cache_put(cache, 'nuccore_gi', [['NC_1.1', '1'], ['NC_2.1', '2']])
+		self.assertEqual(lookupcache.cache_get(cache, 'nuccore_gi', 'NC_1.1'), '1')
+		lookupcache.commit_cache(cache)
+
+		# Another worker writes while this one is still using the cache
+		other_cache = lookupcache.open_cache(self.cache_file, 0, 0, False)
+		other_cache['connection'].execute('PRAGMA busy_timeout = 100')
+		lookupcache.cache_put(other_cache, 'nuccore_gi', [['NC_3.1', '3']])
+		lookupcache.close_cache(other_cache)
+
+		self.assertEqual(lookupcache.cache_get(cache, 'nuccore_gi', 'NC_3.1'), '3')
+		lookupcache.close_cache(cache)
+
+	def test_least_recently_used_evicted(self):
+		cache = lookupcache.open_cache(self.cache_file, 0, 2, False)
+		lookupcache.cache_put(cache, 'nuccore_gi', [['NC_1.1', '1'], ['NC_2.1', '2']])
+		lookupcache.cache_put(cache, 'nuccore_gi', [['NC_3.1', '3']])
+		lookupcache.cache_get(cache, 'nuccore_gi', 'NC_1.1')
+		lookupcache.close_cache(cache)
+
+		# Only evicted once per run, not when each worker closes the cache
+		cache = lookupcache.open_cache(self.cache_file, 0, 2, False)
+		self.assertEqual(cache['connection'].execute('SELECT COUNT(*) FROM accessions').fetchone()[0], 3)
+		lookupcache.evict_cache(cache)
+		lookupcache.close_cache(cache)
+
+		cache = lookupcache.open_cache(self.cache_file, 0, 2, False)
+		self.assertEqual(lookupcache.cache_get(cache, 'nuccore_gi', 'NC_1.1'), '1')
+		self.assertIsNone(lookupcache.cache_get(cache, 'nuccore_gi', 'NC_2.1'))
+		lookupcache.close_cache(cache)
+
+
+if __name__ == '__main__':
+	unittest.main()
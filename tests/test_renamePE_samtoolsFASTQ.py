@@ -0,0 +1,122 @@
+import os
+import sys
+import gzip
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import renamePE_samtoolsFASTQ
+
+
+def fastqRecord(generator, name, broken):
+	sequence = ''.join(generator.choice('ACGTN') for i in range(generator.randint(0, 8)))
+	lines = ['@' + name, sequence, generator.choice(['+', '+' + name]), ''.join(generator.choice('@+I#') for i in range(len(sequence)))]
+	if broken:
+		change = generator.randint(0, 3)
+		if change == 0:
+			lines.insert(generator.randint(0, 4), generator.choice(['', '+x', '@y', 'ACG']))
+		elif change == 1:
+			del lines[generator.randint(0, 3)]
+		elif change == 2:
+			lines[0] = lines[0][1:]
+		else:
+			lines[1] = '+' + lines[1]
+	return lines
+
+
+# Lines of both mates, with a few broken records, misaligned names and truncated mates 2
+def randomPairLines(generator):
+	lines_1 = []
+	lines_2 = []
+	for i in range(generator.randint(0, 30)):
+		name = 'r' + str(i)
+		lines_1 += fastqRecord(generator, name, generator.random() < 0.03)
+		lines_2 += fastqRecord(generator, name if generator.random() > 0.01 else 'x' + str(i), generator.random() < 0.03)
+	if generator.random() < 0.2:
+		lines_2 = lines_2[:generator.randint(0, len(lines_2))]
+	return lines_1, lines_2
+
+
+class TestEnginesAgree(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.block_size = renamePE_samtoolsFASTQ.block_size
+		renamePE_samtoolsFASTQ.block_size = 37
+
+	def tearDown(self):
+		renamePE_samtoolsFASTQ.block_size = self.block_size
+		shutil.rmtree(self.directory)
+
+	def rename(self, fastq_1, fastq_2, engine):
+		outdir = os.path.join(self.directory, engine)
+		if not os.path.isdir(outdir):
+			os.makedirs(outdir)
+		try:
+			number_reads, outfiles = renamePE_samtoolsFASTQ.formartFastqHeaders(fastq_1, fastq_2, outdir, False, engine)
+		except SystemExit as e:
+			number_reads = str(e)
+			outfiles = [renamePE_samtoolsFASTQ.renamedFastqPath(fastq_1, outdir, 1, False), renamePE_samtoolsFASTQ.renamedFastqPath(fastq_2, outdir, 2, False)]
+		outputs = []
+		for outfile in outfiles:
+			with open(outfile, 'rb') as reader:
+				outputs.append(reader.read())
+		return number_reads, outputs
+
+	# Returns the result of the line engine, after checking that the others give the same
+	def checkEngines(self, data_1, data_2, compressed=False):
+		fastqs = []
+		for mate, data in ((1, data_1), (2, data_2)):
+			fastq = os.path.join(self.directory, 'a_' + str(mate) + '.fq' + ('.gz' if compressed else ''))
+			with (gzip.open(fastq, 'wb') if compressed else open(fastq, 'wb')) as writer:
+				writer.write(data)
+			fastqs.append(fastq)
+		line_result = self.rename(fastqs[0], fastqs[1], 'line')
+		for engine in ('block', 'pipeline'):
+			self.assertEqual(self.rename(fastqs[0], fastqs[1], engine), line_result, engine + ': ' + repr([data_1, data_2]))
+		return line_result
+
+	def test_well_formed(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\n\n+r2\n\n'
+		number_reads, outputs = self.checkEngines(data, data)
+		self.assertEqual(number_reads, 2)
+		self.assertEqual(outputs[1], '@r1/2\nACGT\n+\nIIII\n@r2/2\n\n+r2\n\n')
+		self.checkEngines(data[:-1], data)
+		self.checkEngines(data, data, True)
+
+	def test_newlines(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\nGG\n+\nII\n'
+		for new_line in ('\r\n', '\r'):
+			self.checkEngines(data.replace('\n', new_line), data.replace('\n', new_line))
+			self.checkEngines(data.replace('\n', new_line), data.replace('\n', new_line), True)
+
+	def test_truncated_mate(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\nGG\n+\nII\n'
+		for end in range(len(data)):
+			self.checkEngines(data, data[:end])
+
+	def test_misaligned(self):
+		data = '@r1\nACGT\n+\nIIII\n@r2\nGG\n+\nII\n'
+		number_reads, outputs = self.checkEngines(data, data.replace('@r2', '@x2'))
+		self.assertEqual(number_reads, 'The PE fastq files are not aligned properly!')
+
+	def test_malformed(self):
+		lines = ['@r1', 'ACGT', '+', 'IIII', '@r2', 'GGGG', '+', 'IIII', '@r3', 'TT', '+', 'II']
+		data = '\n'.join(lines) + '\n'
+		for line in range(len(lines)):
+			for changed_lines in (lines[:line] + lines[line + 1:], lines[:line] + [''] + lines[line:], lines[:line] + ['+' + lines[line]] + lines[line + 1:]):
+				self.checkEngines('\n'.join(changed_lines) + '\n', data)
+
+	def test_random_pairs(self):
+		generator = random.Random(1)
+		for i in range(150):
+			renamePE_samtoolsFASTQ.block_size = generator.randint(1, 64)
+			lines_1, lines_2 = randomPairLines(generator)
+			new_line = generator.choice(['\n', '\n', '\r\n', '\r'])
+			self.checkEngines(new_line.join(lines_1) + generator.choice([new_line, '']), new_line.join(lines_2) + generator.choice([new_line, '']), generator.random() < 0.2)
+
+
+if __name__ == '__main__':
+	unittest.main()